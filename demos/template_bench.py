@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+"""
+Measure the Python overhead of preparing a request, with and without a template
+
+No request is sent, only HttpClient.prepare() and the cleanup after perform run.
+"""
+from __future__ import with_statement
+
+import sys
+from timeit import default_timer
+
+import urllib4
+
+def measure(client, requests):
+    start = default_timer()
+
+    for request in requests:
+        client.prepare(request)
+        client._cleanup()
+
+    return (default_timer() - start) / len(requests)
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+    options = dict(headers={'Accept': 'text/html', 'Accept-Language': 'en'},
+                   user_agent='urllib4', referer='http://www.google.com/',
+                   accept_encoding='gzip', connect_timeout=10, tcp_nodelay=1)
+
+    urls = ['http://www.google.com/search?q=%d' % i for i in range(count)]
+
+    client = urllib4.HttpClient()
+
+    plain = measure(client, [urllib4.HttpRequest(url, **options) for url in urls])
+
+    template = urllib4.RequestTemplate('http://www.google.com/', **options)
+
+    compiled = measure(client, [template.request(url) for url in urls])
+
+    print "prepare:          %6.1f us/request" % (plain * 1000000)
+    print "prepare+template: %6.1f us/request (%.1fx)" % (compiled * 1000000, plain / compiled)
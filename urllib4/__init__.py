@@ -1,26 +1,39 @@
-#!/usr/bin/env python
-import os
-from tempfile import mkstemp
-
-from request import HttpRequest, REDIRECT_INFINITE, REDIRECT_REFUSE
-from response import HttpResponse
-from errors import *
-from client import HttpClient, PROGRESS_CALLBACK_CONTINUE, PROGRESS_CALLBACK_ABORT
-from pipeline import HttpPipeline
-from dnscache import DnsCache
-from pagecache import DictPageCache, MemcachePageCache
-from flowcontrol import SiteProfile
-from connpool import BaseConnection, ConnectionPool
-from adapter import Request, urlopen, urlretrieve
-
-__version__ = '0.3'
-__author__ = 'Flier Lu <flier.lu@gmail.com>'
-__url__ = 'http://code.google.com/p/urllib4/'
-__all__ = ['HttpRequest', 'REDIRECT_INFINITE', 'REDIRECT_REFUSE',
-           'HttpResponse', 'HttpClient', 'HttpPipeline',
-           'PROGRESS_CALLBACK_CONTINUE', 'PROGRESS_CALLBACK_ABORT',
-           'DnsCache', 'DictPageCache', 'MemcachePageCache', 'SiteProfile',
-           'UnsupportedProtocol', 'TooManyRedirects', 'ConnectError',
-           'ProxyResolveError', 'HostResolveError', 'OperationTimeoutError',
-           'BaseConnection', 'ConnectionPool',
-           'Request', 'urlopen',]
+#!/usr/bin/env python
+import os
+from tempfile import mkstemp
+
+from request import HttpRequest, REDIRECT_INFINITE, REDIRECT_REFUSE
+from template import RequestTemplate
+from response import HttpResponse, StreamResponse, CachedResponse
+from errors import *
+from client import HttpClient, PROGRESS_CALLBACK_CONTINUE, PROGRESS_CALLBACK_ABORT
+from pipeline import HttpPipeline, SocketPipeline
+from eventloop import EventLoopPipeline
+from dnscache import DnsCache
+from pagecache import DictPageCache, DiskPageCache, MemcachePageCache, TieredPageCache
+from flowcontrol import SiteProfile
+from sink import FileSink, FSYNC_NEVER, FSYNC_ON_CLOSE
+from connpool import BaseConnection, ConnectionPool, CurlPool
+from share import ShareGroup
+from coalescer import RequestCoalescer
+from urlcache import RedirectCache, NegativeCache
+from adapter import Request, urlopen, urlretrieve, fetch_many, fetch_map
+from recrawl import RecrawlScheduler
+
+__version__ = '0.3'
+__author__ = 'Flier Lu <flier.lu@gmail.com>'
+__url__ = 'http://code.google.com/p/urllib4/'
+__all__ = ['HttpRequest', 'REDIRECT_INFINITE', 'REDIRECT_REFUSE', 'RequestTemplate',
+           'HttpResponse', 'StreamResponse', 'CachedResponse', 'HttpClient',
+           'HttpPipeline', 'SocketPipeline',
+           'EventLoopPipeline',
+           'PROGRESS_CALLBACK_CONTINUE', 'PROGRESS_CALLBACK_ABORT',
+           'DnsCache', 'DictPageCache', 'DiskPageCache', 'MemcachePageCache', 'TieredPageCache', 'SiteProfile',
+           'FileSink', 'FSYNC_NEVER', 'FSYNC_ON_CLOSE',
+           'UnsupportedProtocol', 'TooManyRedirects', 'ConnectError',
+           'ProxyResolveError', 'HostResolveError', 'OperationTimeoutError',
+           'CallbackAborted', 'PartialFileError',
+           'BaseConnection', 'ConnectionPool', 'CurlPool', 'ShareGroup', 'RequestCoalescer',
+           'RedirectCache', 'NegativeCache',
+           'Request', 'urlopen', 'urlretrieve', 'fetch_many', 'fetch_map',
+           'RecrawlScheduler',]
@@ -1,46 +1,176 @@
-#!/usr/bin/env python
-from request import HttpRequest
-from client import HttpClient
-from flowcontrol import SiteProfile
-
-Request = HttpRequest
-
-def urlopen(url_or_request, data_or_reader=None, headers={}, method=None,
-            guess_encoding=None, dnscache=None, pagecache=None,
-            connect_callback=None, progress_callback=None,
-            session_timeout=None, connect_timeout=None, *args, **kwds):
-
-    if issubclass(type(url_or_request), HttpRequest):
-        request = url_or_request
-    else:
-        request = HttpRequest(str(url_or_request), data_or_reader, headers, method, *args, **kwds)
-
-    if session_timeout or connect_timeout:
-        profile = SiteProfile.get(request.hostname)
-        profile.timeout = session_timeout
-        profile.connect_timeout = connect_timeout
-    else:
-        profile = None
-
-    return HttpClient(dnscache=dnscache, pagecache=pagecache,
-        profile=profile, guess_encoding=guess_encoding) \
-            .perform(request, progress_callback, connect_callback)
-
-def urlretrieve(url, filename=None, reporthook=None, data_or_reader=None,
-                dnscache=None, pagecache=None, *args, **kwds):
-
-    request = HttpRequest(url, data_or_reader, *args, **kwds)
-    client = HttpClient(dnscache=dnscache, pagecache=pagecache)
-
-    if filename:
-        client.file = open(filename)
-    else:
-        fd, filename = mkstemp()
-        client.file = os.fdopen(fd)
-
-    def progress(download_total, downloaded, upload_total, uploaded):
-        reporthook(downloaded, 1, download_total)
-
-    response = client.perform(request, progress if reporthook else None)
-
-    return (filename, response.headers)
+#!/usr/bin/env python
+import os
+from tempfile import mkstemp
+from Queue import Queue
+
+from concurrent.futures import Future
+
+from request import HttpRequest
+from client import HttpClient
+from pipeline import SocketPipeline
+from connpool import get_default_curlpool
+from sink import FileSink
+from download import download_resume
+
+Request = HttpRequest
+
+def urlopen(url_or_request, data_or_reader=None, headers={}, method=None,
+            guess_encoding=None, dnscache=None, pagecache=None,
+            connect_callback=None, progress_callback=None,
+            session_timeout=None, connect_timeout=None, share=None, *args, **kwds):
+
+    if issubclass(type(url_or_request), HttpRequest):
+        request = url_or_request
+    else:
+        request = HttpRequest(str(url_or_request), data_or_reader, headers, method, *args, **kwds)
+
+    # the timeouts are applied to the leased handle through the request
+    if session_timeout:
+        request.session_timeout = session_timeout
+
+    if connect_timeout:
+        request.connect_timeout = connect_timeout
+
+    return HttpClient(dnscache=dnscache, pagecache=pagecache,
+        guess_encoding=guess_encoding, curlpool=get_default_curlpool(), share=share) \
+            .perform(request, progress_callback, connect_callback)
+
+def urlretrieve(url, filename=None, reporthook=None, data_or_reader=None,
+                dnscache=None, pagecache=None, *args, **kwds):
+
+    resume = kwds.pop('resume', False)
+    client = HttpClient(dnscache=dnscache, pagecache=pagecache,
+                        curlpool=get_default_curlpool())
+
+    def progress(download_total, downloaded, upload_total, uploaded):
+        reporthook(downloaded, 1, download_total)
+
+    if resume and filename:
+        response = download_resume(client, url, filename, progress if reporthook else None,
+                                   data_or_reader, *args, **kwds)
+
+        return (filename, response.headers)
+
+    request = HttpRequest(url, data_or_reader, *args, **kwds)
+
+    if filename:
+        sink = FileSink(filename)
+    else:
+        fd, filename = mkstemp()
+        sink = FileSink(os.fdopen(fd, 'wb'))
+
+    client._set_target(sink)
+
+    try:
+        response = client.perform(request, progress if reporthook else None)
+    finally:
+        sink.close()
+
+    return (filename, response.headers)
+
+def _as_request(url_or_request):
+    if issubclass(type(url_or_request), HttpRequest):
+        return url_or_request
+
+    return HttpRequest(str(url_or_request))
+
+class _Batch(object):
+    def __init__(self, pipeline, kwds):
+        self.own_pipeline = pipeline is None
+        self.pipeline = SocketPipeline(concurrency=0) if pipeline is None else pipeline
+        self.kwds = kwds
+        self.finished = Queue()
+
+    def __enter__(self):
+        if self.own_pipeline:
+            self.pipeline.start()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.own_pipeline:
+            self.pipeline.terminate()
+            self.pipeline.join()
+            self.pipeline.close()
+
+    def submit(self, request):
+        self.kwds.setdefault('curlpool', get_default_curlpool())
+
+        try:
+            return HttpClient(**self.kwds).async_perform(_as_request(request), pipeline=self.pipeline)
+        except Exception, e:
+            # the request fails on its own, not the batch
+            future = Future()
+            future.set_running_or_notify_cancel()
+            future.set_exception(e)
+
+            return future
+
+    def submit_notify(self, request):
+        self.submit(request).add_done_callback(self.finished.put)
+
+def fetch_many(requests, concurrency=10, pipeline=None, **kwds):
+    """
+    Fetch the URLs or HttpRequests on one shared multi handle
+
+    At most concurrency transfers are in flight, the futures are yielded
+    in the order they complete, the extra keywords are passed to HttpClient.
+    """
+    requests = iter(requests)
+
+    with _Batch(pipeline, kwds) as batch:
+        inflight = 0
+
+        for request in requests:
+            batch.submit_notify(request)
+
+            inflight += 1
+
+            if inflight >= concurrency:
+                break
+
+        while inflight > 0:
+            future = batch.finished.get()
+
+            inflight -= 1
+
+            for request in requests:
+                batch.submit_notify(request)
+
+                inflight += 1
+
+                break
+
+            yield future
+
+def fetch_map(requests, concurrency=10, pipeline=None, **kwds):
+    """
+    Fetch the URLs or HttpRequests and yield the responses in the input order
+
+    A failed request raises its PycurlError, and no request is started more
+    than concurrency positions ahead of the response yielded last.
+    """
+    requests = iter(requests)
+
+    with _Batch(pipeline, kwds) as batch:
+        futures = {}
+        submitted = 0
+        yielded = 0
+
+        while True:
+            while submitted < yielded + concurrency:
+                try:
+                    request = requests.next()
+                except StopIteration:
+                    break
+
+                futures[submitted] = batch.submit(request)
+                submitted += 1
+
+            if yielded == submitted:
+                break
+
+            future = futures.pop(yielded)
+            yielded += 1
+
+            yield future.result()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+class RingBuffer(object):
+    """
+    Fixed size byte FIFO backed by a single bytearray
+
+    >>> ring = RingBuffer(4)
+    >>> ring.write('abc')
+    >>> ring.read(2)
+    'ab'
+    >>> ring.write('def')
+    >>> ring.read(4)
+    'cdef'
+    """
+    def __init__(self, capacity):
+        self.buffer = bytearray(capacity)
+        self.start = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def capacity(self):
+        return len(self.buffer)
+
+    @property
+    def free(self):
+        return len(self.buffer) - self.size
+
+    def grow(self, capacity):
+        """enlarge the buffer to hold at least capacity bytes"""
+        if capacity > len(self.buffer):
+            data = self.read(self.size)
+
+            self.buffer = bytearray(capacity)
+            self.start = 0
+            self.size = 0
+
+            self.write(data)
+
+    def write(self, data):
+        """append the data, the caller must ensure it fits"""
+        size = len(data)
+
+        if size > self.free:
+            raise ValueError("%d bytes don't fit in %d free bytes" % (size, self.free))
+
+        capacity = len(self.buffer)
+        end = (self.start + self.size) % capacity
+        first = min(size, capacity - end)
+        view = memoryview(data)
+
+        self.buffer[end:end+first] = view[:first]
+
+        if first < size:
+            self.buffer[0:size-first] = view[first:]
+
+        self.size += size
+
+    def readinto(self, b):
+        """move up to len(b) bytes into the writable buffer b"""
+        size = min(len(b), self.size)
+        capacity = len(self.buffer)
+        first = min(size, capacity - self.start)
+        src = memoryview(self.buffer)
+        dst = memoryview(b)
+
+        dst[:first] = src[self.start:self.start+first]
+
+        if first < size:
+            dst[first:size] = src[:size-first]
+
+        self.start = (self.start + size) % capacity
+        self.size -= size
+
+        return size
+
+    def read(self, size=-1):
+        if size < 0 or size > self.size:
+            size = self.size
+
+        capacity = len(self.buffer)
+        first = min(size, capacity - self.start)
+        view = memoryview(self.buffer)
+        data = view[self.start:self.start+first].tobytes()
+
+        if first < size:
+            data += view[:size-first].tobytes()
+
+        self.start = (self.start + size) % capacity
+        self.size -= size
+
+        return data
+
+class BodyBuffer(object):
+    """
+    Growable byte buffer which accumulates a response body in one bytearray
+
+    The buffer can be sized up front from Content-Length, so a body is
+    written in place without intermediate chunks, and read back through
+    buffer()/memoryview() without copying.
+    """
+    # don't trust a Content-Length beyond this for preallocating
+    MAX_RESERVE = 64 * 1024 * 1024
+
+    def __init__(self, capacity=0):
+        self.buffer = bytearray(capacity)
+        self.size = 0
+
+    @classmethod
+    def wrap(cls, data):
+        """read-only buffer over existing data, like a str or an mmap, without copying it"""
+        body = cls()
+        body.buffer = data
+        body.size = len(data)
+
+        return body
+
+    def __len__(self):
+        return self.size
+
+    def __nonzero__(self):
+        return True
+
+    @property
+    def capacity(self):
+        return len(self.buffer)
+
+    def reserve(self, capacity):
+        capacity = min(capacity, max(self.MAX_RESERVE, self.size))
+
+        if capacity > len(self.buffer):
+            self.buffer += bytearray(capacity - len(self.buffer))
+
+    def write(self, data):
+        end = self.size + len(data)
+
+        if end > len(self.buffer):
+            self.buffer += bytearray(max(end, 2 * len(self.buffer)) - len(self.buffer))
+
+        self.buffer[self.size:end] = data
+        self.size = end
+
+    def getbuffer(self):
+        """read-only view of the content, it must not outlive a later write"""
+        return buffer(self.buffer, 0, self.size)
+
+    def getview(self):
+        return memoryview(self.buffer)[:self.size]
+
+    def getvalue(self):
+        return str(self.getbuffer())
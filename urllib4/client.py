@@ -1,448 +1,944 @@
-#!/usr/bin/env python
-import sys, os, os.path
-import string, binascii
-import logging
-from hashlib import md5
-import socket
-from functools import partial
-
-try:
-    from gurl import Url
-    urlparse = Url
-except ImportError:
-    from urlparse import urlparse
-
-try:
-    from cStringIO import StringIO
-except ImportError:
-    from StringIO import StringIO
-
-import urllib
-
-import pycurl
-
-from request import HttpRequest
-from response import HttpResponse
-from errors import PycurlError
-from pipeline import get_default_pipeline
-from flowcontrol import SiteProfile
-from guessencoding import guess_encoding, guess_charset
-
-PROGRESS_CALLBACK_CONTINUE = 0
-PROGRESS_CALLBACK_ABORT = 1
-
-READ_CALLBACK_ABORT = pycurl.READFUNC_ABORT
-
-"""
-def debug_callback(type, msg):
-    pass
-
-def header_callback(buf):
-    return len(buf)
-
-def write_callback(buf):
-    return len(buf) # number of characters written
-
-def read_callback(size):
-    return <str> or READ_CALLBACK_ABORT
-
-def progress_callback(download_total, downloaded, upload_total, uploaded):
-    return PROGRESS_CALLBACK_CONTINUE or PROGRESS_CALLBACK_ABORT
-
-def ioctl_callback(cmd):
-    return <status>
-"""
-
-class HttpClient(object):
-    INFOTYPE_NAMES = {
-        pycurl.INFOTYPE_DATA_IN: 'data:in',
-        pycurl.INFOTYPE_DATA_OUT: 'data:out',
-        pycurl.INFOTYPE_HEADER_IN: 'header:in',
-        pycurl.INFOTYPE_HEADER_OUT: 'header:out',
-        pycurl.INFOTYPE_SSL_DATA_IN: 'ssl:in',
-        pycurl.INFOTYPE_SSL_DATA_OUT: 'ssl:out',
-        pycurl.INFOTYPE_TEXT: 'text',
-    }
-
-    def __init__(self, dnscache=None, pagecache=None, pipeline=None,
-                 profile=None, guess_encoding=None, dump_raw_data=False):
-        self.dnscache = dnscache
-        self.pagecache = pagecache
-        self.pipeline = pipeline
-        self.profile = profile
-        self.guess_encoding = guess_encoding
-        self.dump_raw_data = dump_raw_data
-
-        self.curl = pycurl.Curl()
-
-        self.header = []
-        self.body = []
-        self.file = None
-
-    def __del__(self):
-        self.curl.close()
-
-    def _log(self, type, msg):
-        if self.dump_raw_data:
-            if [c for c in msg if c not in string.printable]:
-                logging.debug("%s: %s", self.INFOTYPE_NAMES[type], binascii.hexlify(msg))
-            else:
-                logging.debug("%s: %s", self.INFOTYPE_NAMES[type], msg)
-
-    def _cleanup(self):
-        self.curl.setopt(pycurl.DEBUGFUNCTION, lambda type, msg: None)
-        self.curl.setopt(pycurl.HEADERFUNCTION, lambda buf: None)
-        self.curl.setopt(pycurl.WRITEFUNCTION, lambda buf: None)
-        self.curl.setopt(pycurl.READFUNCTION, lambda size: None)
-        self.curl.setopt(pycurl.PROGRESSFUNCTION, lambda download_total, downloaded, upload_total, uploaded: None)
-        self.curl.setopt(pycurl.IOCTLFUNCTION, lambda cmd: None)
-
-        if hasattr(pycurl, 'OPENSOCKETFUNCTION'):
-            self.curl.setopt(pycurl.OPENSOCKETFUNCTION, lambda family, type, proto: None)
-
-    def _apply_debug_setting(self, request):
-        self.curl.setopt(pycurl.VERBOSE, 1)
-        self.curl.setopt(pycurl.DEBUGFUNCTION, self._log)
-
-    def _apply_progress_setting(self, progress_callback):
-        if progress_callback:
-            self.curl.setopt(pycurl.NOPROGRESS, 0)
-            self.curl.setopt(pycurl.PROGRESSFUNCTION, progress_callback)
-        else:
-            self.curl.setopt(pycurl.NOPROGRESS, 1)
-
-    def _header_callback(self, buf):
-        self.header.append(buf)
-
-    def _write_callback(self, buf):
-        if self.file:
-            self.file.write(buf)
-        else:
-            self.body.append(buf)
-
-    def _apply_request_setting(self, request):
-        self.curl.setopt(pycurl.HEADERFUNCTION, self._header_callback)
-        self.curl.setopt(pycurl.WRITEFUNCTION, self._write_callback)
-
-        if request.data_or_reader:
-            if callable(request.data_or_reader):
-                self.curl.setopt(pycurl.POST, 1)
-                self.curl.setopt(pycurl.READFUNCTION, request.data_or_reader)
-            else:
-                if type(request.data_or_reader) == dict:
-                    self.curl.setopt(pycurl.POSTFIELDS, urllib.urlencode(request.data_or_reader))
-                elif type(request.data_or_reader) == list:
-                    self.curl.setopt(pycurl.HTTPPOST, request.data_or_reader)
-                else:
-                    self.curl.setopt(pycurl.POSTFIELDS, str(request.data_or_reader))
-
-            if request.method not in ['POST', None]:
-                self.curl.setopt(pycurl.CUSTOMREQUEST, request.method)
-        else:
-            if request.method == 'HEAD':
-                self.curl.setopt(pycurl.CURLOPT_NOBODY, 1)
-            elif request.method not in ['GET', None]:
-                self.curl.setopt(pycurl.CUSTOMREQUEST, request.method)
-            else:
-                self.curl.setopt(pycurl.HTTPGET, 1)
-
-        self.curl.setopt(pycurl.HTTPHEADER, ["%s: %s" % (key, value) for key, value in request.headers.items()])
-
-    def _apply_dnscache_setting(self, request, connect_callback=None):
-        o = urlparse(request.url)
-
-        if self.dnscache:
-            address = self.dnscache.get(o.hostname)[0]
-        elif connect_callback:
-            address = socket.gethostbyname(o.hostname)
-
-            connect_callback(request, address)
-        else:
-            address = None
-
-        if address:
-            request.add_header('host', o.hostname)
-
-            return o.hostname, request.url.replace(o.hostname, address)
-
-        return o.hostname, request.url
-
-    def _apply_timeout_setting(self, request):
-        if request.session_timeout:
-            self.curl.setopt(pycurl.TIMEOUT, request.session_timeout)
-
-        if request.connect_timeout:
-            self.curl.setopt(pycurl.CONNECTTIMEOUT, request.connect_timeout)
-
-        self.curl.setopt(pycurl.NOSIGNAL, 1 if request.no_signal else 0)
-
-    @staticmethod
-    def _create_socket(request, family, type, proto):
-        s = socket.socket(family, type, proto)
-
-        if request.sendbuf:
-            s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, request.sendbuf)
-
-        if request.recvbuf:
-            s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, request.recvbuf)
-
-        return s
-
-    def _apply_network_setting(self, request):
-        if hasattr(pycurl, 'OPENSOCKETFUNCTION'):
-            self.curl.setopt(pycurl.OPENSOCKETFUNCTION, partial(self._create_socket, request))
-
-        if request.interface:
-            self.curl.setopt(pycurl.INTERFACE, request.interface)
-
-        if request.local_port:
-            self.curl.setopt(pycurl.LOCALPORT, request.local_port)
-
-        if request.local_port_range:
-            self.curl.setopt(pycurl.LOCALPORTRANGE, request.local_port_range)
-
-        if request.tcp_nodelay:
-            self.curl.setopt(pycurl.TCP_NODELAY, request.tcp_nodelay)
-
-        if request.bufsize:
-            self.curl.setopt(pycurl.BUFFERSIZE, request.bufsize)
-
-    def _apply_ssl_setting(self, request):
-        if request.ssl_verify_peer:
-            self.curl.setopt(pycurl.SSL_VERIFYPEER, 1)
-
-            # TODO: setup the CA path
-        else:
-            self.curl.setopt(pycurl.SSL_VERIFYPEER, 0)
-
-        if request.ssl_verify_host:
-            # the certificate must indicate that the server is the server
-            # to which you meant to connect, or the connection fails.
-            self.curl.setopt(pycurl.SSL_VERIFYHOST, 2)
-        else:
-            self.curl.setopt(pycurl.SSL_VERIFYHOST, 0)
-
-    def _apply_auth_setting(self, request):
-        if request.username and request.password:
-            if request.realm:
-                self.curl.setopt(pycurl.USERPWD, "%s/%s:%s" % (request.realm, request.username, request.password))
-            else:
-                self.curl.setopt(pycurl.USERPWD, "%s:%s" % (request.username, request.password))
-
-        self.curl.setopt(pycurl.HTTPAUTH, request.http_auth_mode)
-
-    def _apply_redirect_setting(self, request):
-        self.curl.setopt(pycurl.AUTOREFERER, 1 if request.auto_referer else 0)
-        self.curl.setopt(pycurl.FOLLOWLOCATION, 1 if request.follow_location else 0)
-        self.curl.setopt(pycurl.MAXREDIRS, request.max_redirects)
-
-    def _apply_http_setting(self, request):
-        if request.http_version:
-            self.curl.setopt(pycurl.HTTP_VERSION, request.http_version)
-
-        if request.range:
-            self.curl.setopt(pycurl.RANGE, "%d-%d" % tuple(request.range))
-
-        if request.referer:
-            self.curl.setopt(pycurl.REFERER, request.referer)
-
-        if request.user_agent:
-            self.curl.setopt(pycurl.USERAGENT, request.user_agent)
-
-        if request.accept_encoding:
-            self.curl.setopt(pycurl.ENCODING, request.accept_encoding)
-            self.curl.setopt(pycurl.HTTP_CONTENT_DECODING, 1)
-        else:
-            self.curl.setopt(pycurl.HTTP_CONTENT_DECODING, 0)
-
-        if request.cookie_or_file:
-            if os.path.exists(request.cookie_or_file):
-                self.curl.setopt(pycurl.COOKIEFILE, request.cookie_or_file)
-            else:
-                if issubclass(type(request.cookie_or_file), dict):
-                    cookie = ';'.join(['%s=%s' % (k, v) for k, v in request.cookie_or_file.items()])
-                else:
-                    cookie = request.cookie_or_file
-
-                self.curl.setopt(pycurl.COOKIE, cookie)
-
-    def _apply_proxy_setting(self, request):
-        if request.proxy_host:
-            self.curl.setopt(pycurl.PROXY, request.proxy_host)
-            self.curl.setopt(pycurl.PROXYTYPE, request.proxy_type)
-
-            if request.proxy_auth:
-                self.curl.setopt(pycurl.PROXYUSERPWD, request.proxy_auth)
-
-            self.curl.setopt(pycurl.PROXYAUTH, request.proxy_auth_mode)
-
-        else:
-            self.curl.setopt(pycurl.PROXY, "")
-
-    def _apply_pagecache_setting(self, request):
-        if self.pagecache:
-            self.page = self.pagecache.get(request.url, request.get_method())
-
-            if self.page.etag:
-                request.add_header('If-None-Match', '"%s"' % self.page.etag)
-
-            if self.page.last_modified:
-                request.add_header('If-Modified-Since', self.page.last_modified)
-
-    def _update_pagecache_setting(self, response):
-        if self.pagecache and response.code == 200:
-            hash = md5()
-
-            for data in self.body:
-                hash.update(data)
-
-            etag = response.headers.get('ETag', None)
-
-            if etag and etag[0] == '"' and etag[-1] == '"':
-                etag = etag[1:-1]
-
-            if self.page.md5 == hash.hexdigest():
-                response.code = 304
-
-            self.page.md5 = hash.hexdigest()
-            self.page.etag = etag
-            self.page.last_modified = response.headers.get('Last-Modified', None)
-            self.page.update()
-
-    @property
-    def status(self):
-        from httplib import HTTPMessage
-
-        header = StringIO(''.join(self.header))
-        try:
-            return header.readline()
-        finally:
-            header.close()
-
-    @property
-    def headers(self):
-        from httplib import HTTPMessage
-
-        header = StringIO(''.join(self.header))
-        try:
-            header.readline() # eat the first line 'HTTP/1.1 200 OK'
-            return HTTPMessage(header)
-        finally:
-            header.close()
-
-    def close(self):
-        self.curl.close()
-
-    def get(self, url, progress_callback=None, *args, **kwds):
-        return self.perform(HttpRequest(url, *args, **kwds), progress_callback)
-
-    def async_get(self, url, finish_callback, pipeline=None, progress_callback=None, *args, **kwds):
-        return self.async_perform(request=HttpRequest(url, *args, **kwds),
-                                  finish_callback=finish_callback,
-                                  pipeline=pipeline,
-                                  progress_callback=progress_callback)
-
-    def post(self, url, data_or_reader, progress_callback=None, *args, **kwds):
-        return self.perform(HttpRequest(url, data_or_reader, *args, **kwds), progress_callback)
-
-    def async_post(self, url, data_or_reader, finish_callback, pipeline=None, progress_callback=None, *args, **kwds):
-        return self.async_perform(request=HttpRequest(url, data_or_reader, *args, **kwds),
-                                  finish_callback=finish_callback,
-                                  pipeline=pipeline,
-                                  progress_callback=progress_callback)
-
-    def download(self, url, file, progress_callback=None, *args, **kwds):
-        self.file = file
-
-        return self.perform(HttpRequest(url, *args, **kwds), progress_callback)
-
-    def async_download(self, url, file, finish_callback, pipeline=None, progress_callback=None, *args, **kwds):
-        self.file = file
-
-        def onfinish(*args, **kwds):
-            self.file.close()
-
-            finish_callback(*args, **kwds)
-
-        return self.async_perform(request=HttpRequest(url, *args, **kwds),
-                                  finish_callback=onfinish,
-                                  pipeline=pipeline,
-                                  progress_callback=progress_callback)
-
-    def prepare(self, request, progress_callback=None, connect_callback=None):
-        request.client = self
-
-        self.header = []
-        self.body = []
-
-        self._apply_debug_setting(request)
-        self._apply_progress_setting(progress_callback)
-
-        domain, request.url = self._apply_dnscache_setting(request, connect_callback)
-
-        profile = self.profile or SiteProfile.get(domain)
-        profile.apply(self.curl)
-
-        self.curl.setopt(pycurl.URL, request.url)
-
-        self._apply_pagecache_setting(request)
-        self._apply_request_setting(request)
-        self._apply_timeout_setting(request)
-        self._apply_network_setting(request)
-        self._apply_http_setting(request)
-        self._apply_ssl_setting(request)
-        self._apply_redirect_setting(request)
-        self._apply_auth_setting(request)
-        self._apply_proxy_setting(request)
-
-    def postmortem(self, response):
-        self.file = None
-
-        self._update_pagecache_setting(response)
-
-        if self.guess_encoding is not None:
-            charset = guess_charset(response.headers.get("Content-Type"))
-
-            if type(self.guess_encoding) == str:
-                self.guess_encoding = [self.guess_encoding, charset]
-            elif type(self.guess_encoding) == list:
-                self.guess_encoding += [charset]
-            else:
-                self.guess_encoding = [charset]
-
-            text, response.encoding, response.declared_encoding = \
-                guess_encoding(''.join(self.body), self.guess_encoding + [charset])
-
-        return response
-
-    def perform(self, request, progress_callback=None, connect_callback=None):
-        self.prepare(request, progress_callback, connect_callback)
-
-        response = HttpResponse(self, request)
-
-        try:
-            self.curl.perform()
-        except pycurl.error, (code, msg):
-            PycurlError.convert(code, msg, response)
-        finally:
-            self._cleanup()
-
-        return self.postmortem(response)
-
-    def async_perform(self, request, finish_callback, pipeline=None, progress_callback=None):
-        if pipeline is None:
-            pipeline = self.pipeline
-
-        if pipeline is None:
-            pipeline = get_default_pipeline()
-
-        self.prepare(request, progress_callback)
-
-        def onfinish(client, errno, errmsg):
-            self._cleanup()
-
-            response = self.postmortem(request)
-
-            finish_callback(response, errno, errmsg)
-
-        pipeline.add(self, onfinish)
+#!/usr/bin/env python
+import sys, os, os.path
+import string, binascii
+import logging
+from hashlib import md5
+import socket
+import copy
+import weakref
+from functools import partial
+
+try:
+    from gurl import Url
+    urlparse = Url
+except ImportError:
+    from urlparse import urlparse
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+import urllib
+
+from concurrent.futures import Future
+
+import pycurl
+
+from request import HttpRequest, REDIRECT_REFUSE
+from response import HttpResponse, StreamResponse, CachedResponse
+from pagecache import header_lines
+from errors import PycurlError
+from pipeline import get_default_pipeline
+from eventloop import get_loop_pipeline, create_future
+from flowcontrol import SiteProfile
+from guessencoding import guess_encoding, guess_charset
+from buffer import BodyBuffer
+from sink import FileSink
+from urlcache import DEFAULT_PORTS
+
+PROGRESS_CALLBACK_CONTINUE = 0
+PROGRESS_CALLBACK_ABORT = 1
+
+READ_CALLBACK_ABORT = pycurl.READFUNC_ABORT
+
+"""
+def debug_callback(type, msg):
+    pass
+
+def header_callback(buf):
+    return len(buf)
+
+def write_callback(buf):
+    return len(buf) # number of characters written
+
+def read_callback(size):
+    return <str> or READ_CALLBACK_ABORT
+
+def progress_callback(download_total, downloaded, upload_total, uploaded):
+    return PROGRESS_CALLBACK_CONTINUE or PROGRESS_CALLBACK_ABORT
+
+def ioctl_callback(cmd):
+    return <status>
+"""
+
+class HttpClient(object):
+    INFOTYPE_NAMES = {
+        pycurl.INFOTYPE_DATA_IN: 'data:in',
+        pycurl.INFOTYPE_DATA_OUT: 'data:out',
+        pycurl.INFOTYPE_HEADER_IN: 'header:in',
+        pycurl.INFOTYPE_HEADER_OUT: 'header:out',
+        pycurl.INFOTYPE_SSL_DATA_IN: 'ssl:in',
+        pycurl.INFOTYPE_SSL_DATA_OUT: 'ssl:out',
+        pycurl.INFOTYPE_TEXT: 'text',
+    }
+
+    def __init__(self, dnscache=None, pagecache=None, pipeline=None,
+                 profile=None, guess_encoding=None, dump_raw_data=False,
+                 curlpool=None, share=None, stale_while_revalidate=None, stale_if_error=None,
+                 coalescer=None, redirectcache=None, negativecache=None):
+        self.dnscache = dnscache
+        self.pagecache = pagecache
+        self.pipeline = pipeline
+        self.profile = profile
+        self.guess_encoding = guess_encoding
+        self.dump_raw_data = dump_raw_data
+        self.curlpool = curlpool
+        self.share = share
+        # seconds a stale page may be served when its response doesn't tell
+        self.stale_while_revalidate = stale_while_revalidate
+        self.stale_if_error = stale_if_error
+        self.coalescer = coalescer
+        self.redirectcache = redirectcache
+        self.negativecache = negativecache
+
+        # a pooled client leases its handle from the pool in prepare()
+        self.curl = None if curlpool is not None else pycurl.Curl()
+        self.curl_key = None
+        self.curl_template = None
+
+        self.header = []
+        self.body = BodyBuffer()
+        self.file = None
+        self.sink = None
+        self.addresses = None
+        self.page = None
+        # a weak reference, the request refers to the client once it's prepared
+        self.page_request = None
+        # the URL of the request before the DNS cache may rewrite it
+        self.request_url = None
+
+    def __del__(self):
+        self.close()
+
+    def _log(self, type, msg):
+        if self.dump_raw_data:
+            if [c for c in msg if c not in string.printable]:
+                logging.debug("%s: %s", self.INFOTYPE_NAMES[type], binascii.hexlify(msg))
+            else:
+                logging.debug("%s: %s", self.INFOTYPE_NAMES[type], msg)
+
+    def _lease(self, url):
+        key = self.curlpool.key(url, self.share)
+
+        if self.curl is not None and self.curl_key == key:
+            return
+
+        self._release()
+
+        self.curl = self.curlpool.get(key)
+        self.curl_key = key
+        self.curl_template = None
+
+    def _release(self):
+        if self.curl is not None:
+            if self.share is None:
+                # a pipeline may have attached its share group to the handle
+                self.curl.unsetopt(pycurl.SHARE)
+
+            self.curlpool.put(self.curl, self.curl_key)
+
+            self.curl = None
+            self.curl_key = None
+
+    def _cleanup(self, errno=0):
+        self._update_dnscache_setting(errno)
+
+        self.curl.setopt(pycurl.DEBUGFUNCTION, lambda type, msg: None)
+        self.curl.setopt(pycurl.HEADERFUNCTION, lambda buf: None)
+        self.curl.setopt(pycurl.WRITEFUNCTION, lambda buf: None)
+        self.curl.setopt(pycurl.READFUNCTION, lambda size: None)
+        self.curl.setopt(pycurl.PROGRESSFUNCTION, lambda download_total, downloaded, upload_total, uploaded: None)
+        self.curl.setopt(pycurl.IOCTLFUNCTION, lambda cmd: None)
+
+        if hasattr(pycurl, 'OPENSOCKETFUNCTION'):
+            self.curl.setopt(pycurl.OPENSOCKETFUNCTION, lambda family, type, proto: None)
+
+    def _apply_debug_setting(self, request):
+        self.curl.setopt(pycurl.VERBOSE, 1)
+        self.curl.setopt(pycurl.DEBUGFUNCTION, self._log)
+
+    def _apply_progress_setting(self, progress_callback):
+        if progress_callback:
+            self.curl.setopt(pycurl.NOPROGRESS, 0)
+            self.curl.setopt(pycurl.PROGRESSFUNCTION, progress_callback)
+        else:
+            self.curl.setopt(pycurl.NOPROGRESS, 1)
+
+    def _header_callback(self, buf):
+        self.header.append(buf)
+
+        if buf[:5] == 'HTTP/' and self.sink:
+            try:
+                code = int(buf.split(None, 2)[1])
+            except (IndexError, ValueError):
+                pass
+            else:
+                if self.sink.begin(code) is False:
+                    return 0 # curl aborts the transfer
+
+        if buf[:15].lower() == 'content-length:' and not self.file:
+            try:
+                if self.sink:
+                    self.sink.reserve(int(buf[15:]))
+                else:
+                    self.body.reserve(int(buf[15:]))
+            except ValueError:
+                pass
+
+    def _write_callback(self, buf):
+        if self.file:
+            self.file.write(buf)
+        else:
+            self.body.write(buf)
+
+    def _apply_request_setting(self, request):
+        self.curl.setopt(pycurl.HEADERFUNCTION, self._header_callback)
+        self.curl.setopt(pycurl.WRITEFUNCTION, self._write_callback)
+
+        if request.data_or_reader:
+            if callable(request.data_or_reader):
+                self.curl.setopt(pycurl.POST, 1)
+                self.curl.setopt(pycurl.READFUNCTION, request.data_or_reader)
+            else:
+                if type(request.data_or_reader) == dict:
+                    self.curl.setopt(pycurl.POSTFIELDS, urllib.urlencode(request.data_or_reader))
+                elif type(request.data_or_reader) == list:
+                    self.curl.setopt(pycurl.HTTPPOST, request.data_or_reader)
+                else:
+                    self.curl.setopt(pycurl.POSTFIELDS, str(request.data_or_reader))
+
+            if request.method not in ['POST', None]:
+                self.curl.setopt(pycurl.CUSTOMREQUEST, request.method)
+        else:
+            if request.method == 'HEAD':
+                self.curl.setopt(pycurl.NOBODY, 1)
+            elif request.method not in ['GET', None]:
+                self.curl.setopt(pycurl.CUSTOMREQUEST, request.method)
+            else:
+                self.curl.setopt(pycurl.HTTPGET, 1)
+
+        self.curl.setopt(pycurl.HTTPHEADER, ["%s: %s" % (key, value) for key, value in request.headers.items()])
+
+    def _apply_dnscache_setting(self, request, connect_callback=None):
+        if request.template:
+            hostname = request.template.hostname(request.url)
+        else:
+            hostname = urlparse(request.url).hostname
+
+        if self.dnscache:
+            addresses = self.addresses = self.dnscache.select(hostname)
+        elif connect_callback:
+            addresses = [socket.gethostbyname(hostname)]
+
+            connect_callback(request, addresses[0])
+        else:
+            addresses = None
+
+        if addresses:
+            addresses = ['[%s]' % address if ':' in address else address for address in addresses]
+
+            if hasattr(pycurl, 'RESOLVE'):
+                # pin the addresses in curl's own DNS cache, so the URL, SNI and
+                # the connection cache still see the hostname
+                o = urlparse(request.url)
+                port = o.port or DEFAULT_PORTS.get(o.scheme, 80)
+
+                self.curl.setopt(pycurl.RESOLVE, ['-%s:%d' % (hostname, port),
+                                                  '%s:%d:%s' % (hostname, port, ','.join(addresses))])
+            else:
+                request.add_header('host', hostname)
+
+                return hostname, request.url.replace(hostname, addresses[0])
+
+        return hostname, request.url
+
+    def _update_dnscache_setting(self, errno=0):
+        if self.addresses:
+            address = self.curl.getinfo(pycurl.PRIMARY_IP) or self.addresses[0]
+            connect_time = self.curl.getinfo(pycurl.CONNECT_TIME)
+
+            # a transfer which failed before it connected counts against the address
+            failed = errno == pycurl.E_COULDNT_CONNECT or (errno != 0 and not connect_time)
+
+            self.dnscache.report(self.addresses, address, connect_time, failed)
+
+            self.addresses = None
+
+    def _apply_timeout_setting(self, request):
+        if request.session_timeout:
+            self.curl.setopt(pycurl.TIMEOUT, request.session_timeout)
+
+        if request.connect_timeout:
+            self.curl.setopt(pycurl.CONNECTTIMEOUT, request.connect_timeout)
+
+        self.curl.setopt(pycurl.NOSIGNAL, 1 if request.no_signal else 0)
+
+    @staticmethod
+    def _create_socket(request, family, type, proto):
+        s = socket.socket(family, type, proto)
+
+        if request.sendbuf:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, request.sendbuf)
+
+        if request.recvbuf:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, request.recvbuf)
+
+        return s
+
+    def _apply_network_setting(self, request):
+        if hasattr(pycurl, 'OPENSOCKETFUNCTION'):
+            self.curl.setopt(pycurl.OPENSOCKETFUNCTION, partial(self._create_socket, request))
+
+        if request.interface:
+            self.curl.setopt(pycurl.INTERFACE, request.interface)
+
+        if request.local_port:
+            self.curl.setopt(pycurl.LOCALPORT, request.local_port)
+
+        if request.local_port_range:
+            self.curl.setopt(pycurl.LOCALPORTRANGE, request.local_port_range)
+
+        if request.tcp_nodelay:
+            self.curl.setopt(pycurl.TCP_NODELAY, request.tcp_nodelay)
+
+        if request.bufsize:
+            self.curl.setopt(pycurl.BUFFERSIZE, request.bufsize)
+
+    def _apply_ssl_setting(self, request):
+        if request.ssl_verify_peer:
+            self.curl.setopt(pycurl.SSL_VERIFYPEER, 1)
+
+            # TODO: setup the CA path
+        else:
+            self.curl.setopt(pycurl.SSL_VERIFYPEER, 0)
+
+        if request.ssl_verify_host:
+            # the certificate must indicate that the server is the server
+            # to which you meant to connect, or the connection fails.
+            self.curl.setopt(pycurl.SSL_VERIFYHOST, 2)
+        else:
+            self.curl.setopt(pycurl.SSL_VERIFYHOST, 0)
+
+    def _apply_auth_setting(self, request):
+        if request.username and request.password:
+            if request.realm:
+                self.curl.setopt(pycurl.USERPWD, "%s/%s:%s" % (request.realm, request.username, request.password))
+            else:
+                self.curl.setopt(pycurl.USERPWD, "%s:%s" % (request.username, request.password))
+
+        self.curl.setopt(pycurl.HTTPAUTH, request.http_auth_mode)
+
+    def _apply_redirect_setting(self, request):
+        self.curl.setopt(pycurl.AUTOREFERER, 1 if request.auto_referer else 0)
+        self.curl.setopt(pycurl.FOLLOWLOCATION, 1 if request.follow_location else 0)
+        self.curl.setopt(pycurl.MAXREDIRS, request.max_redirects)
+
+    def _apply_http_setting(self, request):
+        if request.http_version:
+            self.curl.setopt(pycurl.HTTP_VERSION, request.http_version)
+
+        if request.range:
+            self.curl.setopt(pycurl.RANGE, request.get_range())
+        else:
+            # the handle may have served a range request before
+            self.curl.unsetopt(pycurl.RANGE)
+
+        if request.referer:
+            self.curl.setopt(pycurl.REFERER, request.referer)
+
+        if request.user_agent:
+            self.curl.setopt(pycurl.USERAGENT, request.user_agent)
+
+        if request.accept_encoding:
+            self.curl.setopt(pycurl.ENCODING, request.accept_encoding)
+            self.curl.setopt(pycurl.HTTP_CONTENT_DECODING, 1)
+        else:
+            self.curl.setopt(pycurl.HTTP_CONTENT_DECODING, 0)
+
+        if request.cookie_or_file:
+            if os.path.exists(request.cookie_or_file):
+                self.curl.setopt(pycurl.COOKIEFILE, request.cookie_or_file)
+            else:
+                if issubclass(type(request.cookie_or_file), dict):
+                    cookie = ';'.join(['%s=%s' % (k, v) for k, v in request.cookie_or_file.items()])
+                else:
+                    cookie = request.cookie_or_file
+
+                self.curl.setopt(pycurl.COOKIE, cookie)
+
+    def _apply_proxy_setting(self, request):
+        if request.proxy_host:
+            self.curl.setopt(pycurl.PROXY, request.proxy_host)
+            self.curl.setopt(pycurl.PROXYTYPE, request.proxy_type)
+
+            if request.proxy_auth:
+                self.curl.setopt(pycurl.PROXYUSERPWD, request.proxy_auth)
+
+            self.curl.setopt(pycurl.PROXYAUTH, request.proxy_auth_mode)
+
+        else:
+            self.curl.setopt(pycurl.PROXY, "")
+
+    def _lookup_page(self, request):
+        if self._page_of(request) is None:
+            self.page = self.pagecache.get(request.url, request.get_method(), request)
+            self.page_request = weakref.ref(request)
+
+        return self.page
+
+    def _page_of(self, request):
+        """the page looked up for the request, or None"""
+        if self.page_request is not None and self.page_request() is request:
+            return self.page
+
+    def _serve_cached(self, request):
+        """
+        @return the response of the request which is known without a transfer, or None
+        """
+        return self._serve_negativecache(request) or self._serve_pagecache(request)
+
+    def _apply_redirectcache_setting(self, request):
+        """
+        @return the request to perform, a copy of it for the final URL of its known redirects
+
+        The request only skips the redirects which stay on its scheme, host and port,
+        so its credentials and cookies aren't sent anywhere curl wouldn't send them.
+        """
+        if self.redirectcache is None or not request.follow_location or \
+           request.max_redirects == REDIRECT_REFUSE or request.get_method() not in ('GET', 'HEAD'):
+            return request
+
+        url = self.redirectcache.resolve(request.url, same_origin=True)
+
+        if url == request.url:
+            return request
+
+        request = copy.copy(request)
+        request.url = url
+
+        return request
+
+    def _update_redirectcache_setting(self, response):
+        if self.redirectcache is not None and self.request_url and response.request.follow_location and \
+           response.request.get_method() in ('GET', 'HEAD'):
+            self.redirectcache.learn(self.request_url, response.header)
+
+    def _serve_negativecache(self, request):
+        """
+        @return the failed response which the negative cache remembers for the request, or None
+
+        Raise the remembered error of resolving the host of the request
+        """
+        if self.negativecache is None or request.get_method() not in ('GET', 'HEAD'):
+            return None
+
+        error = self.negativecache.get_error(urlparse(request.url).hostname)
+
+        if error:
+            raise PycurlError.wrap(*error)
+
+        if request.stream or self.file or self.sink:
+            return None
+
+        page = self.negativecache.get_response(request.url, request.get_method())
+
+        return CachedResponse(self, request, page) if page else None
+
+    def _update_negativecache_setting(self, request, response=None, errno=0, errmsg=None):
+        if self.negativecache is None or not self.request_url or request.get_method() not in ('GET', 'HEAD'):
+            return
+
+        if errno == pycurl.E_COULDNT_RESOLVE_HOST:
+            self.negativecache.add_error(urlparse(self.request_url).hostname, errno, errmsg)
+        elif response is not None and not errno and response.code in self.negativecache.codes:
+            body = response.content.getvalue() if self.file is None and self.sink is None else ''
+
+            self.negativecache.add_response(self.request_url, response.code, header_lines(response.header), body,
+                                            request.get_method())
+
+    def _serve_pagecache(self, request):
+        """
+        @return the stored response if it's fresh for the request, or None
+        """
+        if self.pagecache is None or request.stream or self.file or self.sink:
+            return None
+
+        page = self._lookup_page(request)
+
+        if page.fresh(request):
+            self.pagecache.count('hits')
+        elif page.stale(request, 'stale-while-revalidate', self.stale_while_revalidate):
+            self.pagecache.count('stale_hits')
+
+            self._revalidate(request, page)
+        else:
+            return None
+
+        self.page = self.page_request = None
+
+        response = CachedResponse(self, request, page)
+
+        self._apply_guess_encoding(response, response.content)
+
+        return response
+
+    def _serve_stale_if_error(self, request, page, response=None):
+        """
+        @return the stale page instead of the failed transfer or server error, or None
+        """
+        if page is None or (response is not None and response.code not in (500, 502, 503, 504)) or \
+           not page.stale(request, 'stale-if-error', self.stale_if_error):
+            return None
+
+        self.pagecache.count('stale_hits')
+
+        response = CachedResponse(self, request, page)
+
+        self._apply_guess_encoding(response, response.content)
+
+        return response
+
+    def _revalidate(self, request, page):
+        """revalidate the stale page on the pipeline, unless it's already done"""
+        if not self.pagecache.begin_revalidation(page.key):
+            return
+
+        client = HttpClient(dnscache=self.dnscache, pagecache=self.pagecache, pipeline=self.pipeline,
+                            profile=self.profile, curlpool=self.curlpool, share=self.share)
+
+        revalidation = copy.copy(request)
+        revalidation.headers = dict(request.headers)
+        # the stale page must not answer its own revalidation
+        revalidation.add_header('Cache-Control', 'max-age=0')
+
+        try:
+            client.async_perform(revalidation,
+                finish_callback=lambda response, errno, errmsg: self.pagecache.end_revalidation(page.key))
+        except:
+            self.pagecache.end_revalidation(page.key)
+
+            raise
+
+    def _apply_pagecache_setting(self, request):
+        if self.pagecache is not None:
+            page = self._lookup_page(request)
+
+            # a response of a download isn't buffered, so only its validators are kept
+            self.page_store = self.file is None and self.sink is None
+
+            # a 304 can't be answered with the stored body when it's streamed or downloaded
+            if request.stream or not self.page_store or not page.matches(request):
+                return
+
+            if page.etag:
+                request.add_header('If-None-Match', '"%s"' % page.etag)
+
+            if page.last_modified:
+                request.add_header('If-Modified-Since', page.last_modified)
+
+    def _update_pagecache_setting(self, response):
+        page = self._page_of(response.request) if self.pagecache is not None else None
+
+        if page is None:
+            return
+
+        self.page = self.page_request = None
+
+        if response.code == 304 and page.body is not None:
+            # the stored response is still valid, it replaces the empty body
+            self.pagecache.count('revalidations')
+
+            page.refresh(header_lines(self.header))
+            page.update()
+
+            response.content = BodyBuffer.wrap(page.body)
+            response._body = None
+        elif response.code == 200:
+            self.pagecache.count('misses')
+
+            hash = md5(self.body.getbuffer())
+
+            etag = response.headers.get('ETag', None)
+
+            if etag and etag[0] == '"' and etag[-1] == '"':
+                etag = etag[1:-1]
+
+            if page.md5 == hash.hexdigest():
+                response.code = 304
+
+            page.md5 = hash.hexdigest()
+            page.etag = etag
+            page.last_modified = response.headers.get('Last-Modified', None)
+
+            if self.page_store and response.request.get_method() == 'GET':
+                page.store(response.request, 200, header_lines(self.header), self.body.getvalue())
+
+            page.update()
+
+    @property
+    def status(self):
+        from httplib import HTTPMessage
+
+        header = StringIO(''.join(self.header))
+        try:
+            return header.readline()
+        finally:
+            header.close()
+
+    @property
+    def headers(self):
+        from httplib import HTTPMessage
+
+        header = StringIO(''.join(self.header))
+        try:
+            header.readline() # eat the first line 'HTTP/1.1 200 OK'
+            return HTTPMessage(header)
+        finally:
+            header.close()
+
+    def close(self):
+        if self.curlpool is not None:
+            self._release()
+        elif self.curl is not None:
+            self.curl.close()
+
+    def get(self, url, progress_callback=None, *args, **kwds):
+        return self.perform(HttpRequest(url, *args, **kwds), progress_callback)
+
+    def async_get(self, url, finish_callback=None, pipeline=None, progress_callback=None, *args, **kwds):
+        return self.async_perform(request=HttpRequest(url, *args, **kwds),
+                                  finish_callback=finish_callback,
+                                  pipeline=pipeline,
+                                  progress_callback=progress_callback)
+
+    def post(self, url, data_or_reader, progress_callback=None, *args, **kwds):
+        return self.perform(HttpRequest(url, data_or_reader, *args, **kwds), progress_callback)
+
+    def async_post(self, url, data_or_reader, finish_callback=None, pipeline=None, progress_callback=None, *args, **kwds):
+        return self.async_perform(request=HttpRequest(url, data_or_reader, *args, **kwds),
+                                  finish_callback=finish_callback,
+                                  pipeline=pipeline,
+                                  progress_callback=progress_callback)
+
+    def aget(self, url, loop=None, progress_callback=None, *args, **kwds):
+        return self.aperform(HttpRequest(url, *args, **kwds), loop, progress_callback)
+
+    def apost(self, url, data_or_reader, loop=None, progress_callback=None, *args, **kwds):
+        return self.aperform(HttpRequest(url, data_or_reader, *args, **kwds), loop, progress_callback)
+
+    def _set_target(self, file):
+        if FileSink.accept(file):
+            # curl writes a real file itself, without a Python call per chunk
+            self.sink = file if isinstance(file, FileSink) else FileSink(file)
+        else:
+            self.file = file
+
+    def _finish_target(self):
+        if self.sink:
+            self.sink.finish()
+
+        self.file = None
+        self.sink = None
+
+    def download(self, url, file, progress_callback=None, *args, **kwds):
+        """
+        Download to a file name or object, or a FileSink which tunes how the file is written
+
+        With segments=N the file is fetched in N byte ranges on parallel connections,
+        with resume=True a download of a file name continues where an interrupted one
+        stopped, as long as the server still has the same entity.
+        """
+        segments = kwds.pop('segments', 1)
+        resume = kwds.pop('resume', False)
+
+        if resume and isinstance(file, basestring):
+            from download import download_resume
+
+            return download_resume(self, url, file, progress_callback, *args, **kwds)
+
+        if segments > 1:
+            filename = file if isinstance(file, basestring) else getattr(file, 'name', None)
+
+            if filename and (isinstance(file, basestring) or os.path.isfile(filename)):
+                from download import download_segments
+
+                return download_segments(self, url, filename, segments, progress_callback, *args, **kwds)
+
+        self._set_target(file)
+
+        return self.perform(HttpRequest(url, *args, **kwds), progress_callback)
+
+    def async_download(self, url, file, finish_callback=None, pipeline=None, progress_callback=None, *args, **kwds):
+        self._set_target(file)
+
+        def onfinish(*args, **kwds):
+            file.close()
+
+            if finish_callback:
+                finish_callback(*args, **kwds)
+
+        return self.async_perform(request=HttpRequest(url, *args, **kwds),
+                                  finish_callback=onfinish,
+                                  pipeline=pipeline,
+                                  progress_callback=progress_callback)
+
+    def prepare(self, request, progress_callback=None, connect_callback=None):
+        request.client = self
+
+        if self.curlpool is not None:
+            self._lease(request.url)
+
+        if self.share is not None:
+            self.share.attach(self.curl)
+
+        self.header = []
+        self.body = BodyBuffer()
+
+        self._apply_debug_setting(request)
+        self._apply_progress_setting(progress_callback)
+
+        self.request_url = request.url
+
+        domain, request.url = self._apply_dnscache_setting(request, connect_callback)
+
+        if request.template and request.template.domain == domain:
+            self.curl.setopt(pycurl.URL, request.url)
+
+            self._apply_pagecache_setting(request)
+
+            request.template.apply(self, request)
+
+            if self.sink:
+                self.sink.attach(self.curl)
+
+            return
+
+        self.curl_template = None
+
+        profile = self.profile or SiteProfile.get(domain)
+        profile.apply(self.curl)
+
+        self.curl.setopt(pycurl.URL, request.url)
+
+        self._apply_pagecache_setting(request)
+        self._apply_request_setting(request)
+        self._apply_timeout_setting(request)
+        self._apply_network_setting(request)
+        self._apply_http_setting(request)
+        self._apply_ssl_setting(request)
+        self._apply_redirect_setting(request)
+        self._apply_auth_setting(request)
+        self._apply_proxy_setting(request)
+
+        if self.sink:
+            self.sink.attach(self.curl)
+
+    def postmortem(self, response):
+        response.snapshot()
+        self._finish_target()
+
+        self._update_pagecache_setting(response)
+        self._update_redirectcache_setting(response)
+        self._update_negativecache_setting(response.request, response)
+        # the body of a 304 may have been replaced by the stored one
+        self._apply_guess_encoding(response, response.content)
+
+        return response
+
+    def _apply_guess_encoding(self, response, content):
+        if self.guess_encoding is not None:
+            charset = guess_charset(response.headers.get("Content-Type"))
+
+            if type(self.guess_encoding) == str:
+                self.guess_encoding = [self.guess_encoding, charset]
+            elif type(self.guess_encoding) == list:
+                self.guess_encoding += [charset]
+            else:
+                self.guess_encoding = [charset]
+
+            text, response.encoding, response.declared_encoding = \
+                guess_encoding(content.getvalue(), self.guess_encoding + [charset])
+
+    def perform(self, request, progress_callback=None, connect_callback=None):
+        if self.coalescer is not None and self.coalescer.accept(self, request):
+            return self.coalescer.perform(self, request,
+                partial(self._perform, progress_callback=progress_callback, connect_callback=connect_callback))
+
+        return self._perform(request, progress_callback, connect_callback)
+
+    def _perform(self, request, progress_callback=None, connect_callback=None):
+        request = self._apply_redirectcache_setting(request)
+        response = self._serve_cached(request)
+
+        if response:
+            return response
+
+        self.prepare(request, progress_callback, connect_callback)
+
+        if request.stream:
+            # the body isn't kept, so the page cache and encoding guess are skipped
+            return StreamResponse(self, request).start()
+
+        page = self._page_of(request)
+        response = HttpResponse(self, request)
+        errno = 0
+
+        try:
+            self.curl.perform()
+        except pycurl.error, (errno, msg):
+            self._finish_target()
+
+            response.snapshot()
+
+            self._update_negativecache_setting(request, errno=errno, errmsg=msg)
+
+            stale = self._serve_stale_if_error(request, page)
+
+            if stale is None:
+                PycurlError.convert(errno, msg, response)
+        finally:
+            self._cleanup(errno)
+
+        if errno:
+            return stale
+
+        response = self.postmortem(response)
+
+        return self._serve_stale_if_error(request, page, response) or response
+
+    def async_perform(self, request, finish_callback=None, pipeline=None, progress_callback=None):
+        """
+        Perform the request on a pipeline
+
+        @return a concurrent.futures.Future which resolves to the HttpResponse
+        """
+        if self.coalescer is not None and self.coalescer.accept(self, request):
+            return self.coalescer.async_perform(self, request,
+                partial(self._async_perform, pipeline=pipeline, progress_callback=progress_callback),
+                finish_callback)
+
+        return self._async_perform(request, finish_callback, pipeline, progress_callback)
+
+    def _async_perform(self, request, finish_callback=None, pipeline=None, progress_callback=None):
+        if pipeline is None:
+            pipeline = self.pipeline
+
+        if pipeline is None:
+            pipeline = get_default_pipeline()
+
+        future = Future()
+        future.set_running_or_notify_cancel()
+
+        request = self._apply_redirectcache_setting(request)
+
+        try:
+            response = self._serve_cached(request)
+
+            if not response:
+                self.prepare(request, progress_callback)
+        except PycurlError, e:
+            # like a failed transfer, the error of the request ends its future
+            try:
+                if finish_callback:
+                    finish_callback(None, e.code, e.msg)
+            finally:
+                future.set_exception(e)
+
+            return future
+
+        if response:
+            try:
+                if finish_callback:
+                    finish_callback(response, 0, None)
+            finally:
+                future.set_result(response)
+
+            return future
+
+        page = self._page_of(request)
+
+        def onfinish(client, errno, errmsg):
+            self._cleanup(errno)
+
+            if errno:
+                self._update_negativecache_setting(request, errno=errno, errmsg=errmsg)
+
+            response = self.postmortem(HttpResponse(self, request))
+            stale = self._serve_stale_if_error(request, page, None if errno else response)
+
+            if stale:
+                response, errno, errmsg = stale, 0, None
+
+            try:
+                if finish_callback:
+                    finish_callback(response, errno, errmsg)
+            finally:
+                if errno:
+                    future.set_exception(PycurlError.wrap(errno, errmsg, response))
+                else:
+                    future.set_result(response)
+
+        pipeline.add(self, onfinish)
+
+        return future
+
+    def aperform(self, request, loop=None, progress_callback=None):
+        """
+        Perform the request on an asyncio style event loop
+
+        @return a future of the loop which resolves to the HttpResponse
+        """
+        pipeline = get_loop_pipeline(loop)
+        future = create_future(pipeline.loop)
+
+        request = self._apply_redirectcache_setting(request)
+
+        try:
+            response = self._serve_cached(request)
+
+            if not response:
+                self.prepare(request, progress_callback)
+        except PycurlError, e:
+            future.set_exception(e)
+
+            return future
+
+        if response:
+            future.set_result(response)
+
+            return future
+
+        page = self._page_of(request)
+
+        def onfinish(client, errno, errmsg):
+            self._cleanup(errno)
+
+            if future.cancelled():
+                return
+
+            if errno:
+                self._update_negativecache_setting(request, errno=errno, errmsg=errmsg)
+
+            response = self.postmortem(HttpResponse(self, request))
+            stale = self._serve_stale_if_error(request, page, None if errno else response)
+
+            if stale:
+                response, errno, errmsg = stale, 0, None
+
+            if errno:
+                future.set_exception(PycurlError.wrap(errno, errmsg, response))
+            else:
+                future.set_result(response)
+
+        def oncancel(future):
+            if future.cancelled() and self.curl in pipeline.clients:
+                pipeline.remove(self)
+
+                self._cleanup()
+
+        future.add_done_callback(oncancel)
+
+        pipeline.add(self, onfinish)
+
+        return future
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+from __future__ import with_statement
+
+import copy
+import threading
+
+from concurrent.futures import Future
+
+from errors import PycurlError
+
+# methods whose identical requests can share a response
+IDEMPOTENT_METHODS = ('GET', 'HEAD')
+
+class RequestCoalescer(object):
+    """
+    Single-flight of identical requests
+
+    A request which is identical to one already in flight doesn't start its
+    own transfer, it waits for the first one and gets its response, which
+    shares the body buffer. The requests are identical when they have the
+    same page cache key, the same options which shape the response, like the
+    credentials, cookies or range, and the same values of the headers the
+    response varies on; until the URL was answered with Vary, all the
+    headers count.
+
+    >>> coalescer = RequestCoalescer()
+    >>> HttpClient(coalescer=coalescer).get('http://www.google.com/')
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.vary = {}
+
+        self.transfers = 0
+        self.coalesced = 0
+
+    def accept(self, client, request):
+        """whether the request may share the transfer of another one"""
+        return request.get_method() in IDEMPOTENT_METHODS and not request.has_data() and \
+            not request.stream and client.file is None and client.sink is None
+
+    def key(self, client, request):
+        method = request.get_method()
+
+        if client.pagecache is not None:
+            key = client.pagecache.key(method, request.url)
+        else:
+            key = "%s:%s" % (method, request.url)
+
+        headers = dict([(name.lower(), value) for name, value in request.headers.items()])
+        names = self.vary.get(key)
+
+        if names is None:
+            names = sorted(headers.keys())
+
+        options = (request.username, request.password, request.realm, request.http_auth_mode,
+                   request.range, request.cookie_or_file, request.user_agent, request.referer,
+                   request.accept_encoding, request.follow_location, request.max_redirects,
+                   request.proxy_host, request.proxy_type, request.proxy_auth)
+
+        return key, '\n'.join(["%s: %s" % (name, headers.get(name)) for name in names]), options
+
+    def join(self, key):
+        """
+        @return the flight of the key, and whether the caller leads it and must perform the request
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+
+            if flight is not None:
+                self.coalesced += 1
+
+                return flight, False
+
+            flight = self.flights[key] = Future()
+            flight.set_running_or_notify_cancel()
+
+            self.transfers += 1
+
+            return flight, True
+
+    def land(self, key, flight, response=None, exception=None):
+        """finish the flight with the response or the exception of its request"""
+        with self.lock:
+            del self.flights[key]
+
+            if response is not None:
+                vary = response.headers.get('Vary')
+
+                if vary:
+                    self.vary[key[0]] = sorted([name.strip().lower() for name in vary.split(',') if name.strip()])
+
+        if exception is None:
+            flight.set_result(response)
+        else:
+            flight.set_exception(exception)
+
+    @staticmethod
+    def share(response):
+        """a response of its own for a follower, over the same body"""
+        response = copy.copy(response)
+        response._body = None
+
+        return response
+
+    def perform(self, client, request, perform):
+        key = self.key(client, request)
+        flight, leader = self.join(key)
+
+        if not leader:
+            return self.share(flight.result())
+
+        try:
+            response = perform(request)
+        except Exception, e:
+            self.land(key, flight, exception=e)
+
+            raise
+
+        self.land(key, flight, response)
+
+        return response
+
+    def async_perform(self, client, request, async_perform, finish_callback=None):
+        key = self.key(client, request)
+        flight, leader = self.join(key)
+
+        if leader:
+            try:
+                future = async_perform(request, finish_callback)
+            except Exception, e:
+                self.land(key, flight, exception=e)
+
+                raise
+
+            def onfinish(future):
+                if future.exception() is None:
+                    self.land(key, flight, future.result())
+                else:
+                    self.land(key, flight, exception=future.exception())
+
+            future.add_done_callback(onfinish)
+
+            return future
+
+        future = Future()
+        future.set_running_or_notify_cancel()
+
+        def onfinish(flight):
+            e = flight.exception()
+            response = self.share(flight.result()) if e is None else getattr(e, 'response', None)
+
+            try:
+                if finish_callback and e is None:
+                    finish_callback(response, 0, None)
+                elif finish_callback and isinstance(e, PycurlError):
+                    finish_callback(response, e.code, e.msg)
+            finally:
+                if e is None:
+                    future.set_result(response)
+                else:
+                    future.set_exception(e)
+
+        flight.add_done_callback(onfinish)
+
+        return future
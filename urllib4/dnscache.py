@@ -1,30 +1,413 @@
-#!/usr/bin/env python
-from __future__ import with_statement
-
-import threading
-
-import socket 
-
-class DnsCache(object):
-    def __init__(self):
-        self.cache = {}
-        self.cache_lock = threading.Lock()
-    
-    def get(self, domain):
-        with self.cache_lock:
-            addresses = self.cache.get(domain)
-            
-        if not addresses:
-            addresses = self.query(domain)
-            
-            self.set(domain, addresses)
-                
-        return addresses
-    
-    def set(self, domain, addresses):
-        with self.cache_lock:
-            self.cache[domain] = addresses
-    
-    def query(self, domain):
-        #TODO return a wrapped async DNS record
-        return [socket.gethostbyname(domain)]
\ No newline at end of file
+#!/usr/bin/env python
+from __future__ import with_statement
+
+import os
+import time
+import threading
+from tempfile import mkstemp
+
+import socket
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+import pycurl
+
+try:
+    import dns.resolver
+    import dns.exception
+except ImportError:
+    dns = None
+
+from errors import HostResolveError
+from pipeline import Dispatcher
+
+# TTL of the addresses when the resolver doesn't tell it
+DEFAULT_TTL = 300
+MIN_TTL = 30
+MAX_TTL = 3600
+# how long a failed lookup is remembered
+NEGATIVE_TTL = 10
+# how long expired addresses are still served while they're refreshed
+MAX_STALE = 3600
+# the part of the TTL at its end when a hit refreshes the record in the background
+REFRESH_AHEAD = 0.1
+
+# how select() picks the address of a domain
+POLICY_FIRST = 'first'
+POLICY_ROUND_ROBIN = 'round_robin'
+POLICY_LEAST_OUTSTANDING = 'least_outstanding'
+POLICY_EWMA = 'ewma'
+POLICY_HAPPY_EYEBALLS = 'happy_eyeballs'
+
+# weight of the latest connect time in the moving average
+EWMA_ALPHA = 0.3
+# an address which failed to connect is avoided for up to this many seconds
+MAX_BACKOFF = 60
+
+class DnsRecord(list):
+    """
+    Addresses of a domain, or the error of resolving it, until they expire
+    """
+    def __init__(self, addresses, ttl=None, error=None):
+        list.__init__(self, addresses)
+
+        self.ttl = ttl
+        self.expires = None if ttl is None else time.time() + ttl
+        self.error = error
+
+    def expired(self, now=None):
+        return self.expires is not None and (now or time.time()) >= self.expires
+
+class AddressStats(object):
+    """Outcome of the connections to an address"""
+    def __init__(self):
+        self.outstanding = 0
+        self.connect_time = None # moving average in seconds
+        self.connects = 0
+        self.errors = 0
+        self.failures = 0 # consecutive
+        self.avoid_until = 0
+
+    def update(self, connect_time=None, failed=False, now=None):
+        if failed:
+            self.errors += 1
+            self.failures += 1
+            self.avoid_until = (now or time.time()) + min(2 ** self.failures, MAX_BACKOFF)
+        elif connect_time:
+            self.connects += 1
+            self.failures = 0
+            self.avoid_until = 0
+
+            if self.connect_time is None:
+                self.connect_time = connect_time
+            else:
+                self.connect_time += EWMA_ALPHA * (connect_time - self.connect_time)
+
+class _Lookup(object):
+    """A resolution in flight, which the other callers for the domain wait for"""
+    def __init__(self):
+        self.done = threading.Event()
+        self.record = None
+
+class DnsCache(object):
+    """
+    Cache of resolved addresses which honors their TTL
+
+    The IPv4 and IPv6 addresses come from getaddrinfo(), or from dnspython
+    when it's installed so the real TTL of the record is known; it's bounded
+    by min_ttl and max_ttl. A failed lookup is remembered for negative_ttl
+    seconds and raises HostResolveError meanwhile, and concurrent misses for
+    a domain share a single lookup.
+
+    A domain which was resolved before never blocks the caller again: a hit
+    in the last refresh_ahead part of the TTL, or up to max_stale seconds
+    after it, returns the cached addresses and refreshes them on the
+    resolver threads, which also prefetch() domains ahead of their use.
+
+    The resolved addresses can be saved to a snapshot file and loaded by the
+    next process, the records keep their expiry so a stale one is served and
+    refreshed like any other.
+
+    The client picks the addresses of a request with select() and report()s
+    how the connection went, so the policy can spread the load with
+    round_robin or least_outstanding, prefer the fastest address with ewma,
+    or let curl race the best IPv6 and IPv4 ones with happy_eyeballs. An
+    address which failed to connect is skipped while it backs off.
+    """
+    def __init__(self, min_ttl=MIN_TTL, max_ttl=MAX_TTL, negative_ttl=NEGATIVE_TTL,
+                 family=socket.AF_UNSPEC, max_stale=MAX_STALE, refresh_ahead=REFRESH_AHEAD,
+                 resolver=None, concurrency=4, snapshot=None, policy=POLICY_ROUND_ROBIN):
+        self.cache = {}
+        self.cache_lock = threading.Lock()
+        self.pending = {}
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.family = family
+        self.max_stale = max_stale
+        self.refresh_ahead = refresh_ahead
+        self.resolver = resolver
+        self.concurrency = concurrency
+        self.snapshot = snapshot
+        self.policy = policy
+        self.stats = {}
+        self.cursors = {}
+
+        if snapshot and os.path.exists(snapshot):
+            self.load(snapshot)
+
+    def _get_resolver(self):
+        if self.resolver is None:
+            with self.cache_lock:
+                # concurrent first refreshes must not start several pools of threads
+                if self.resolver is None:
+                    self.resolver = Dispatcher(self.concurrency)
+
+        return self.resolver
+
+    def _refresh(self, domain):
+        """register a lookup unless one is in flight, the cache lock must be held"""
+        if domain not in self.pending:
+            self.pending[domain] = _Lookup()
+
+            return self.pending[domain]
+
+    def _dispatch(self, domain, lookup):
+        """run the lookup on the resolver threads, without holding the cache lock"""
+        if lookup:
+            self._get_resolver().dispatch(self._lookup, domain, lookup, True)
+
+    def _lookup(self, domain, lookup, background=False):
+        record = None
+
+        try:
+            record = self.resolve(domain)
+        finally:
+            with self.cache_lock:
+                if record is not None:
+                    old = self.cache.get(domain)
+
+                    # a failed refresh keeps serving the addresses it would have replaced
+                    if not (background and record.error and old):
+                        self.cache[domain] = record
+
+                del self.pending[domain]
+
+            lookup.record = record
+            lookup.done.set()
+
+    def get(self, domain):
+        now = time.time()
+
+        with self.cache_lock:
+            record = self.cache.get(domain)
+            lookup = refresh = None
+
+            if record is not None and record.expires is not None and not record.error and \
+               now >= record.expires - record.ttl * self.refresh_ahead and \
+               now < record.expires + self.max_stale:
+                refresh = self._refresh(domain)
+            elif record is None or record.expired(now):
+                lookup = self.pending.get(domain)
+                leader = lookup is None
+
+                if leader:
+                    lookup = self.pending[domain] = _Lookup()
+
+        self._dispatch(domain, refresh)
+
+        if lookup:
+            if leader:
+                self._lookup(domain, lookup)
+
+                record = lookup.record
+            else:
+                lookup.done.wait()
+
+                record = lookup.record
+
+                if record is None:
+                    raise HostResolveError(pycurl.E_COULDNT_RESOLVE_HOST, "fail to resolve %s" % domain)
+
+        if record.error:
+            raise HostResolveError(pycurl.E_COULDNT_RESOLVE_HOST, "fail to resolve %s, %s" % (domain, record.error))
+
+        return record
+
+    def select(self, domain):
+        """
+        Pick the addresses for a connection to the domain by the policy
+
+        @return the addresses to try, the first one is preferred
+        """
+        addresses = self.get(domain)
+        now = time.time()
+
+        with self.cache_lock:
+            stats = [self.stats.setdefault(address, AddressStats()) for address in addresses]
+            candidates = [(address, stat) for address, stat in zip(addresses, stats)
+                          if stat.avoid_until <= now] or zip(addresses, stats)
+
+            if self.policy == POLICY_ROUND_ROBIN:
+                cursor = self.cursors.get(domain, 0)
+                self.cursors[domain] = cursor + 1
+
+                selected = [candidates[cursor % len(candidates)]]
+            elif self.policy == POLICY_LEAST_OUTSTANDING:
+                selected = [min(candidates, key=lambda (address, stat): (stat.outstanding, stat.connect_time))]
+            elif self.policy == POLICY_EWMA:
+                # an address without a measure is tried first, to get one
+                selected = [min(candidates, key=lambda (address, stat): stat.connect_time)]
+            elif self.policy == POLICY_HAPPY_EYEBALLS:
+                selected = []
+
+                for v6 in (True, False):
+                    family = [(address, stat) for address, stat in candidates if (':' in address) == v6]
+
+                    if family:
+                        selected.append(min(family, key=lambda (address, stat): stat.connect_time))
+            else:
+                selected = candidates[:1]
+
+            for address, stat in selected:
+                stat.outstanding += 1
+
+        return [address for address, stat in selected]
+
+    def report(self, addresses, address=None, connect_time=None, failed=False):
+        """
+        Release the selected addresses, with the outcome of the one connected to
+        """
+        with self.cache_lock:
+            for selected in addresses:
+                stat = self.stats.get(selected)
+
+                if stat and stat.outstanding > 0:
+                    stat.outstanding -= 1
+
+            if address:
+                self.stats.setdefault(address, AddressStats()).update(connect_time, failed)
+
+    def prefetch(self, domains, wait=False):
+        """resolve the domains which aren't cached yet in the background"""
+        now = time.time()
+        lookups = []
+        refreshes = []
+
+        with self.cache_lock:
+            for domain in domains:
+                record = self.cache.get(domain)
+
+                if record is None or record.expired(now):
+                    refreshes.append((domain, self._refresh(domain)))
+
+                if domain in self.pending:
+                    lookups.append(self.pending[domain])
+
+        for domain, lookup in refreshes:
+            self._dispatch(domain, lookup)
+
+        if wait:
+            for lookup in lookups:
+                lookup.done.wait()
+
+    def set(self, domain, addresses, ttl=None):
+        """pin the addresses of the domain, they never expire without a ttl"""
+        with self.cache_lock:
+            self.cache[domain] = DnsRecord(addresses, ttl)
+
+    def load(self, path=None):
+        """
+        Load the records of a snapshot, except those too stale to be served
+
+        @return the number of loaded records
+        """
+        now = time.time()
+        loaded = {}
+
+        try:
+            with open(path or self.snapshot, 'rb') as file:
+                records = json.load(file)
+
+            for domain, (addresses, ttl, expires) in records.items():
+                if expires is not None and now >= expires + self.max_stale:
+                    continue
+
+                # json gives unicode, but curl wants the addresses as str
+                record = DnsRecord([address.encode('ascii') for address in addresses], ttl)
+                record.expires = expires
+
+                loaded[domain.encode('utf-8')] = record
+        except (IOError, ValueError, TypeError, KeyError, AttributeError):
+            return 0
+
+        with self.cache_lock:
+            self.cache.update(loaded)
+
+        return len(loaded)
+
+    def save(self, path=None):
+        """replace the snapshot atomically with the resolved addresses"""
+        path = path or self.snapshot
+
+        with self.cache_lock:
+            records = dict([(domain, (list(record), record.ttl, record.expires))
+                            for domain, record in self.cache.items() if not record.error])
+
+        fd, temp = mkstemp(prefix=os.path.basename(path), dir=os.path.dirname(os.path.abspath(path)))
+
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                json.dump(records, file, separators=(',', ':'))
+                file.flush()
+                os.fsync(file.fileno())
+
+            os.rename(temp, path)
+        except:
+            os.remove(temp)
+
+            raise
+
+    def resolve(self, domain):
+        try:
+            addresses, ttl = self.query_ttl(domain)
+        except socket.gaierror, e:
+            return DnsRecord([], self.negative_ttl, e.args[-1])
+
+        if not addresses:
+            return DnsRecord([], self.negative_ttl, "no address")
+
+        return DnsRecord(addresses, min(max(ttl or DEFAULT_TTL, self.min_ttl), self.max_ttl))
+
+    def query_ttl(self, domain):
+        """
+        Resolve the domain
+
+        @return the addresses and their TTL in seconds, or None if it's unknown
+        """
+        if dns:
+            try:
+                return self._query_dns(domain)
+            except dns.exception.DNSException:
+                pass # the domain may still be in the hosts file
+
+        return self.query(domain), None
+
+    def query(self, domain):
+        """
+        Resolve the domain with the system resolver
+
+        @return the addresses
+        """
+        addresses = []
+
+        for family, socktype, proto, canonname, sockaddr in \
+            socket.getaddrinfo(domain, None, self.family, socket.SOCK_STREAM):
+            if sockaddr[0] not in addresses:
+                addresses.append(sockaddr[0])
+
+        return addresses
+
+    def _query_dns(self, domain):
+        addresses = []
+        ttls = []
+
+        for rdtype, family in (('A', socket.AF_INET), ('AAAA', socket.AF_INET6)):
+            if self.family not in (socket.AF_UNSPEC, family):
+                continue
+
+            try:
+                answer = dns.resolver.query(domain, rdtype)
+            except dns.resolver.NoAnswer:
+                continue
+
+            addresses += [rdata.address for rdata in answer]
+            ttls.append(answer.rrset.ttl)
+
+        if not addresses:
+            raise dns.resolver.NoAnswer()
+
+        return addresses, min(ttls)
@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+import os
+import logging
+from functools import partial
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from concurrent.futures import wait
+
+from errors import PycurlError
+from request import HttpRequest
+from sink import FileSink, _fallocate
+from pagecache import header_lines
+
+# don't split a file into segments smaller than this
+MIN_SEGMENT_SIZE = 256 * 1024
+
+# the checkpoint of a resumable download lives next to the file
+CHECKPOINT_SUFFIX = '.urllib4'
+# bytes received between two checkpoints of a running download
+CHECKPOINT_INTERVAL = 4 * 1024 * 1024
+
+def split_ranges(length, segments, min_segment_size=MIN_SEGMENT_SIZE):
+    """
+    Split [0, length) into at most segments inclusive byte ranges
+
+    >>> split_ranges(1000, 3, 1)
+    [(0, 332), (333, 665), (666, 999)]
+    """
+    segments = max(1, min(segments, length // max(1, min_segment_size)))
+    size = length // segments
+
+    ranges = [(i * size, (i + 1) * size - 1) for i in range(segments)]
+    ranges[-1] = (ranges[-1][0], length - 1)
+
+    return ranges
+
+def content_range_start(value):
+    """
+    The first byte of a Content-Range header, or None
+
+    >>> content_range_start('bytes 100-199/1000')
+    100
+    """
+    try:
+        unit, _, spec = value.strip().partition(' ')
+
+        return int(spec.split('-', 1)[0]) if unit == 'bytes' else None
+    except (AttributeError, ValueError):
+        return None
+
+def download_segments(client, url, filename, segments, progress_callback=None, *args, **kwds):
+    """
+    Download the file on several connections, each fetching a byte range
+
+    The server is probed with a HEAD request, and every range is written by
+    curl itself into its own handle of the preallocated file, opened at the
+    offset of the range. If the server doesn't advertise byte ranges, or
+    answers a range request with the whole body, the file is fetched on a
+    single connection instead; a segment refuses the whole body as soon as
+    its status line arrives.
+
+    The segments run on the pipeline keyword, or on a pipeline of their own.
+
+    @return the response of the probe, which describes the whole file
+    """
+    from client import HttpClient
+    from adapter import _Batch
+
+    pipeline = kwds.pop('pipeline', None)
+
+    probe = client.perform(HttpRequest(url, method='HEAD', *args, **kwds))
+
+    length = int(probe.headers.get('Content-Length') or 0)
+    ranges = split_ranges(length, segments)
+
+    if probe.code != 200 or len(ranges) < 2 or \
+       probe.headers.get('Accept-Ranges', '').lower() != 'bytes':
+        return client.download(url, filename, progress_callback, *args, **kwds)
+
+    with open(filename, 'wb') as file:
+        # the file system may not support preallocation, or be out of space
+        if not _fallocate or _fallocate(file.fileno(), 0, 0, length) != 0:
+            file.truncate(length)
+
+    progress = [(0, 0)] * len(ranges)
+
+    def onprogress(index, download_total, downloaded, upload_total, uploaded):
+        progress[index] = (download_total, downloaded)
+
+        return progress_callback(sum([total for total, done in progress]),
+                                 sum([done for total, done in progress]), 0, 0)
+
+    with _Batch(pipeline or client.pipeline, {}) as batch:
+        futures = []
+        sinks = []
+
+        try:
+            for index, (start, end) in enumerate(ranges):
+                file = open(filename, 'r+b')
+                file.seek(start)
+
+                sinks.append(FileSink(file, preallocate=False, partial=True))
+
+                # the segments resolve, throttle and resume TLS sessions like the client
+                segment = HttpClient(dnscache=client.dnscache, profile=client.profile,
+                                     curlpool=client.curlpool, share=client.share)
+                segment._set_target(sinks[-1])
+
+                futures.append(segment.async_perform(HttpRequest(url, range=(start, end), *args, **kwds),
+                    pipeline=batch.pipeline,
+                    progress_callback=partial(onprogress, index) if progress_callback else None))
+
+            wait(futures)
+        finally:
+            for sink in sinks:
+                sink.close()
+
+    for future, (start, end) in zip(futures, ranges):
+        error = future.exception()
+        response = getattr(error, 'response', None) if error else future.result()
+
+        # a segment which refused the whole body failed with its 200 response
+        if error and (response is None or response.code != 200):
+            raise error
+
+        if response.code != 206 or response.size_download != end - start + 1:
+            logging.info("server ignored the range %d-%d of %s, fall back to a single connection", start, end, url)
+
+            return client.download(url, filename, progress_callback, *args, **kwds)
+
+    return probe
+
+class Checkpoint(object):
+    """
+    Sidecar record of an interrupted download
+
+    It keeps the URL, the validators of the entity (ETag and Last-Modified)
+    and how many bytes of it were durably written, the file is only trusted
+    up to that many bytes when the download is resumed.
+    """
+    def __init__(self, filename):
+        self.path = filename + CHECKPOINT_SUFFIX
+        self.url = None
+        self.etag = None
+        self.last_modified = None
+        self.committed = 0
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as file:
+                state = json.load(file)
+
+            self.url = state['url']
+            self.etag = state.get('etag')
+            self.last_modified = state.get('last_modified')
+            self.committed = int(state.get('committed', 0))
+        except (IOError, ValueError, KeyError, TypeError):
+            return False
+
+        return True
+
+    def save(self):
+        """replace the checkpoint atomically, a crash leaves the old or the new one"""
+        temp = self.path + '.tmp'
+
+        with open(temp, 'wb') as file:
+            json.dump({
+                'url': self.url,
+                'etag': self.etag,
+                'last_modified': self.last_modified,
+                'committed': self.committed,
+            }, file)
+            file.flush()
+            os.fsync(file.fileno())
+
+        os.rename(temp, self.path)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def record(self, url, header, sink):
+        """
+        Save how much of the entity the sink durably holds, with the validators of its response
+        """
+        if sink.code not in (200, 206):
+            return
+
+        self.url = url
+        self.etag = self.last_modified = None
+
+        for line in header_lines(header)[1:]:
+            name, _, value = line.partition(':')
+
+            if name.strip().lower() == 'etag':
+                self.etag = value.strip()
+            elif name.strip().lower() == 'last-modified':
+                self.last_modified = value.strip()
+
+        self.committed = sink.commit()
+
+        if self.validator:
+            self.save()
+
+    @property
+    def validator(self):
+        return self.etag or self.last_modified
+
+def download_resume(client, url, filename, progress_callback=None, *args, **kwds):
+    """
+    Download the file, continuing an earlier download which was interrupted
+
+    The request asks for the bytes after the checkpoint with If-Range, so the
+    server either sends the rest of the same entity, which is appended, or the
+    whole new one, which replaces the file. The data received is fsync()ed and
+    recorded in the checkpoint every CHECKPOINT_INTERVAL bytes and when the
+    transfer fails; an error response leaves the file as it was.
+    """
+    checkpoint = Checkpoint(filename)
+    offset = 0
+
+    if checkpoint.load() and checkpoint.url == url and checkpoint.validator and \
+       os.path.isfile(filename):
+        offset = min(checkpoint.committed, os.path.getsize(filename))
+
+    request = HttpRequest(url, *args, **kwds)
+
+    if offset:
+        request.range = (offset, None)
+        request.add_header('If-Range', checkpoint.validator)
+
+        file = open(filename, 'r+b')
+        file.truncate(offset)
+        file.seek(offset)
+    else:
+        file = open(filename, 'wb')
+
+    sink = FileSink(file, offset=offset)
+    client._set_target(sink)
+
+    saved = [0]
+
+    def onprogress(download_total, downloaded, upload_total, uploaded):
+        if downloaded - saved[0] >= CHECKPOINT_INTERVAL:
+            saved[0] = downloaded
+
+            checkpoint.record(url, client.header, sink)
+
+        if progress_callback:
+            return progress_callback(download_total, downloaded, upload_total, uploaded)
+
+    try:
+        try:
+            response = client.perform(request, onprogress)
+        except PycurlError, e:
+            checkpoint.record(url, client.header, sink)
+
+            raise
+
+        # a range which doesn't start at the offset can't be appended, the file is fetched again
+        restart = response.code == 206 and \
+            content_range_start(response.headers.get('Content-Range')) != sink.offset
+
+        # the rest of the entity, or all of the new one, completes the file
+        completed = response.code == (206 if sink.offset else 200) and not restart
+
+        if restart:
+            file.truncate(0)
+        elif not completed:
+            # drop the body of the error response, the checkpoint still describes the file
+            file.truncate(sink.offset)
+    finally:
+        file.close()
+
+    if restart:
+        logging.info("server sent another range than bytes %d- of %s, download it again", sink.offset, url)
+
+        checkpoint.remove()
+
+        return download_resume(client, url, filename, progress_callback, *args, **kwds)
+
+    if completed:
+        checkpoint.remove()
+
+    return response
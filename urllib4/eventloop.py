@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+import weakref
+
+try:
+    import asyncio
+except ImportError:
+    try:
+        import trollius as asyncio
+    except ImportError:
+        asyncio = None
+
+import pycurl
+
+class EventLoopPipeline(object):
+    """
+    Pipeline driven by an asyncio style event loop
+
+    The curl sockets are registered with the loop through add_reader/add_writer
+    and curl's timer through call_later, so the transfers run on the thread of
+    the loop without any pipeline or dispatcher thread. The finish callbacks
+    are called on the loop thread as well.
+    """
+    def __init__(self, loop=None):
+        if loop is None:
+            if asyncio is None:
+                raise ImportError("asyncio or trollius is required")
+
+            loop = asyncio.get_event_loop()
+
+        self._loop = weakref.ref(loop)
+        self.pipeline = pycurl.CurlMulti()
+        self.clients = {}
+        self.sockets = {}
+        self.timer = None
+
+        self.pipeline.setopt(pycurl.M_SOCKETFUNCTION, self._socket_callback)
+        self.pipeline.setopt(pycurl.M_TIMERFUNCTION, self._timer_callback)
+
+    @property
+    def loop(self):
+        # the pipelines are cached per loop, don't keep the loop alive
+        return self._loop()
+
+    def close(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+        for fd in self.sockets.keys():
+            self._unwatch(fd)
+
+        self.pipeline.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, client, callback):
+        self.clients[client.curl] = (client, callback)
+
+        self.pipeline.add_handle(client.curl)
+
+        return client
+
+    def remove(self, client):
+        client, callback = self.clients[client.curl]
+
+        del self.clients[client.curl]
+
+        self.pipeline.remove_handle(client.curl)
+
+        return client, callback
+
+    def _unwatch(self, fd):
+        event = self.sockets.pop(fd, pycurl.POLL_NONE)
+
+        if event & pycurl.POLL_IN:
+            self.loop.remove_reader(fd)
+
+        if event & pycurl.POLL_OUT:
+            self.loop.remove_writer(fd)
+
+    def _socket_callback(self, event, fd, multi, data):
+        self._unwatch(fd)
+
+        if event == pycurl.POLL_REMOVE:
+            return
+
+        if event & pycurl.POLL_IN:
+            self.loop.add_reader(fd, self._socket_action, fd, pycurl.CSELECT_IN)
+
+        if event & pycurl.POLL_OUT:
+            self.loop.add_writer(fd, self._socket_action, fd, pycurl.CSELECT_OUT)
+
+        self.sockets[fd] = event
+
+    def _timer_callback(self, timeout_ms):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+        if timeout_ms >= 0:
+            self.timer = self.loop.call_later(timeout_ms / 1000.0, self._timeout)
+
+    def _timeout(self):
+        self.timer = None
+
+        self._socket_action(pycurl.SOCKET_TIMEOUT, 0)
+
+    def _socket_action(self, fd, mask):
+        while True:
+            ret, num_handles = self.pipeline.socket_action(fd, mask)
+
+            if ret != pycurl.E_CALL_MULTI_PERFORM:
+                break
+
+        self._read_info()
+
+    def _read_info(self):
+        while True:
+            num_queued, ok_list, err_list = self.pipeline.info_read()
+
+            finished = [(curl, 0, None) for curl in ok_list] + err_list
+
+            for curl, errno, errmsg in finished:
+                client, callback = self.remove(self.clients[curl][0])
+
+                try:
+                    callback(client, errno, errmsg)
+                except:
+                    import traceback
+
+                    traceback.print_exc()
+
+            if num_queued == 0:
+                break
+
+__pipelines = weakref.WeakKeyDictionary()
+
+def get_loop_pipeline(loop=None):
+    if loop is None:
+        if asyncio is None:
+            raise ImportError("asyncio or trollius is required")
+
+        loop = asyncio.get_event_loop()
+
+    pipeline = __pipelines.get(loop)
+
+    if pipeline is None:
+        pipeline = __pipelines[loop] = EventLoopPipeline(loop)
+
+    return pipeline
+
+def create_future(loop):
+    if hasattr(loop, 'create_future'):
+        return loop.create_future()
+
+    return asyncio.Future(loop=loop)
@@ -1,72 +1,958 @@
-#!/usr/bin/env python
-import memcache
-
-try:
-    import json
-except ImportError:
-    import simplejson as json
-
-class BasePage(object):
-    def __init__(self, cache, key, md5=None, etag=None, last_modified=None):
-        self.cache = cache
-        self.key = key
-        self.md5 = md5
-        self.etag = etag
-        self.last_modified = last_modified
-
-    def update(self):
-        self.cache.update(self)
-
-    def __repr__(self):
-        return "<%s key=%s, md5=%s, etag=%s, last_modified=%s>" % \
-            (self.__class__.__name__, self.key, self.md5, self.etag, self.last_modified)
-
-class BasePageCache(object):
-    def key(self, method, url):
-        return "%s:%s" % (method, url)
-
-    def get(self, url, method):
-        raise NotImplementedError()
-
-    def update(self, page):
-        raise NotImplementedError()
-
-class DictPageCache(BasePageCache):
-    def __init__(self):
-        BasePageCache.__init__(self)
-
-        self.pages = {}
-
-    def get(self, url, method):
-        key = self.key(method, url)
-
-        return self.pages.setdefault(key, BasePage(self, key))
-
-    def update(self, page):
-        pass
-
-class MemcachePageCache(BasePageCache):
-    def __init__(self, servers, debug=False):
-        BasePageCache.__init__(self)
-
-        self.mc = memcache.Client(servers, debug=1 if debug else 0)
-
-    def get(self, url, method):
-        key = self.key(method, url)
-        data = self.mc.get(key)
-
-        if data:
-            params = dict([(k.encode('utf-8'), v.encode('utf-8') if v else v) for k, v in json.loads(data).items()])
-
-            page = BasePage(self, key, **params)
-
-            return page
-
-        return BasePage(self, key)
-
-    def update(self, page):
-        self.mc.set(page.key, json.dumps({
-            'md5': page.md5,
-            'etag': page.etag,
-            'last_modified': page.last_modified,
-        }))
+#!/usr/bin/env python
+from __future__ import with_statement
+
+import os
+import time
+import mmap
+import struct
+import hashlib
+import threading
+from collections import OrderedDict
+from tempfile import mkstemp
+from email.utils import parsedate_tz, mktime_tz
+
+import memcache
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+def parse_cache_control(value):
+    """
+    Parse a Cache-Control header into a dict of the lowercased directives
+
+    >>> sorted(parse_cache_control('no-cache, max-age="60", Private').items())
+    [('max-age', '60'), ('no-cache', None), ('private', None)]
+    """
+    directives = {}
+
+    for directive in (value or '').split(','):
+        name, sep, arg = directive.strip().partition('=')
+
+        if name:
+            directives[name.lower()] = arg.strip('"') if sep else None
+
+    return directives
+
+def parse_http_date(value):
+    parsed = parsedate_tz(value) if value else None
+
+    return mktime_tz(parsed) if parsed else None
+
+def _seconds(value):
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return None
+
+def header_lines(headers):
+    """the header lines of the final response, the status line first"""
+    starts = [i for i, line in enumerate(headers) if line[:5] == 'HTTP/']
+
+    return [line for line in headers[starts[-1] if starts else 0:] if line.strip()]
+
+class BasePage(object):
+    """
+    Stored response of a cache key
+
+    A page keeps the validators of the response, and once stored the status,
+    header lines and body with the time until which it's fresh, and the
+    request headers named by Vary which a request must match to use it.
+    """
+    __slots__ = ['cache', 'key', 'md5', 'etag', 'last_modified',
+                 'code', 'header', 'body', 'expires', 'vary',
+                 'size', 'evict_at', 'uses', 'slot']
+
+    def __init__(self, cache, key, md5=None, etag=None, last_modified=None,
+                 code=None, header=None, body=None, expires=None, vary=None):
+        self.cache = cache
+        self.key = key
+        self.md5 = md5
+        self.etag = etag
+        self.last_modified = last_modified
+        self.code = code
+        self.header = header
+        self.body = body
+        self.expires = expires
+        self.vary = vary
+        # bookkeeping of the cache which holds the page
+        self.size = 0
+        self.evict_at = None
+        self.uses = 0
+        self.slot = None
+
+    def update(self):
+        self.cache.update(self)
+
+    def matches(self, request):
+        """whether the request selects this response by the headers it varies on"""
+        if self.vary:
+            headers = dict([(key.lower(), value) for key, value in request.headers.items()])
+
+            for name, value in self.vary.items():
+                if headers.get(name) != value:
+                    return False
+
+        return True
+
+    def fresh(self, request, now=None):
+        """whether the response can be served to the request without the network"""
+        if self.body is None or not self.expires or (now or time.time()) >= self.expires:
+            return False
+
+        directives = parse_cache_control(request.headers.get('Cache-Control'))
+
+        if 'no-cache' in directives or 'no-store' in directives or \
+           directives.get('max-age') == '0' or request.headers.get('Pragma') == 'no-cache':
+            return False
+
+        return self.matches(request)
+
+    def stale(self, request, directive, default=None, now=None):
+        """
+        Whether the stale response can still be served, within the seconds
+        which the directive of the response, stale-while-revalidate or
+        stale-if-error, or else the default allows past its freshness
+        """
+        if self.body is None:
+            return False
+
+        headers = self.cache.parse_headers(self.header)
+        directives = parse_cache_control(headers.get('cache-control'))
+
+        if 'no-cache' in directives or 'must-revalidate' in directives or \
+           'proxy-revalidate' in directives and self.cache.shared:
+            return False
+
+        window = _seconds(directives.get(directive))
+
+        if window is None:
+            window = default
+
+        expires = self.expires or parse_http_date(headers.get('date'))
+
+        if not window or not expires or (now or time.time()) >= expires + window:
+            return False
+
+        directives = parse_cache_control(request.headers.get('Cache-Control'))
+
+        if 'no-cache' in directives or 'no-store' in directives or \
+           directives.get('max-age') == '0' or request.headers.get('Pragma') == 'no-cache':
+            return False
+
+        return self.matches(request)
+
+    def store(self, request, code, header, body, now=None):
+        """
+        Keep the response, or forget it if it must not be stored
+
+        @return whether it was stored
+        """
+        headers = self.cache.parse_headers(header)
+        directives = parse_cache_control(headers.get('cache-control'))
+        vary = [name.strip().lower() for name in headers.get('vary', '').split(',') if name.strip()]
+
+        if 'no-store' in directives or '*' in vary or \
+           'no-store' in parse_cache_control(request.headers.get('Cache-Control')) or \
+           ('private' in directives and self.cache.shared):
+            self.code = self.header = self.body = self.expires = self.vary = None
+
+            return False
+
+        request_headers = dict([(key.lower(), value) for key, value in request.headers.items()])
+
+        self.code = code
+        self.header = header
+        self.body = body
+        self.vary = dict([(name, request_headers.get(name)) for name in vary]) or None
+        self.expires = self.cache.expires(headers, directives, now)
+
+        return True
+
+    def refresh(self, header, now=None):
+        """merge the headers of a 304 into the stored ones, they may extend the freshness"""
+        updated = self.cache.parse_headers(header)
+        lines = self.header[:1]
+
+        for line in self.header[1:]:
+            if line.split(':', 1)[0].strip().lower() not in updated:
+                lines.append(line)
+
+        self.header = lines + header[1:]
+
+        headers = self.cache.parse_headers(self.header)
+
+        self.expires = self.cache.expires(headers, parse_cache_control(headers.get('cache-control')), now)
+
+    def __repr__(self):
+        return "<%s key=%s, md5=%s, etag=%s, last_modified=%s>" % \
+            (self.__class__.__name__, self.key, self.md5, self.etag, self.last_modified)
+
+class BasePageCache(object):
+    """
+    HTTP cache of the responses, as a private cache per RFC 7234 unless shared
+
+    The hits are served without the network, a revalidation is a stored
+    response which the server confirmed with a 304, and a miss is a request
+    which had to fetch the response. A stale hit is a response served after
+    its freshness, as stale-while-revalidate or stale-if-error (RFC 5861).
+    """
+    shared = False
+
+    def __init__(self):
+        self.revalidating = set()
+        self.revalidating_lock = threading.Lock()
+
+        self.counters_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.stale_hits = 0
+
+    def count(self, counter):
+        """add one to a counter, hits, misses, revalidations or stale_hits"""
+        with self.counters_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def begin_revalidation(self, key):
+        """
+        @return whether the caller should revalidate the page, or it's already done
+        """
+        with self.revalidating_lock:
+            if key in self.revalidating:
+                return False
+
+            self.revalidating.add(key)
+
+            return True
+
+    def end_revalidation(self, key):
+        with self.revalidating_lock:
+            self.revalidating.discard(key)
+
+    def key(self, method, url):
+        return "%s:%s" % (method, url)
+
+    @staticmethod
+    def parse_headers(header):
+        headers = {}
+
+        for line in header[1:]:
+            name, sep, value = line.partition(':')
+
+            if sep:
+                name = name.strip().lower()
+                value = value.strip()
+
+                headers[name] = "%s, %s" % (headers[name], value) if name in headers else value
+
+        return headers
+
+    def expires(self, headers, directives, now=None):
+        """
+        The time until which a response is fresh, or None if it must be revalidated
+        """
+        now = now or time.time()
+
+        if 'no-cache' in directives:
+            return None
+
+        date = parse_http_date(headers.get('date')) or now
+        age = max(_seconds(headers.get('age')) or 0, now - date)
+
+        if self.shared and _seconds(directives.get('s-maxage')) is not None:
+            lifetime = _seconds(directives['s-maxage'])
+        elif _seconds(directives.get('max-age')) is not None:
+            lifetime = _seconds(directives['max-age'])
+        elif 'expires' in headers:
+            expires = parse_http_date(headers['expires'])
+            lifetime = max(0, expires - date) if expires else 0
+        else:
+            return None
+
+        return now - age + lifetime if lifetime > age else None
+
+    def get(self, url, method, request=None):
+        """the page of the url, the variant selected by the request when the cache keeps several"""
+        raise NotImplementedError()
+
+    def update(self, page):
+        raise NotImplementedError()
+
+    def update_many(self, pages):
+        for page in pages:
+            self.update(page)
+
+EVICT_LRU = 'lru'
+EVICT_LFU = 'lfu'
+
+def page_size(page):
+    """approximate bytes held by a page"""
+    return len(page.key) + len(page.body or '') + sum([len(line) for line in page.header or []])
+
+class DictPageCache(BasePageCache):
+    """
+    In-memory page cache bounded by entries and bytes
+
+    A page is only kept once it's updated, pages live for at most ttl
+    seconds, and the least recently (lru) or least frequently (lfu) used
+    ones are evicted in O(1) when max_pages or max_bytes is exceeded.
+    A response with Vary is kept once per value of the headers it names.
+    """
+    def __init__(self, max_pages=None, max_bytes=None, ttl=None, policy=EVICT_LRU):
+        BasePageCache.__init__(self)
+
+        self.max_pages = max_pages
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.policy = policy
+
+        self.lock = threading.Lock()
+        self.pages = OrderedDict() # slot -> page, in the order of use for lru
+        self.buckets = {} # use count -> slots in the order of use, for lfu
+        self.variants = {} # key -> the request headers its responses vary on
+        self.min_uses = 0
+        self.size = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.pages)
+
+    @staticmethod
+    def _variant(key, names, headers):
+        return key + ''.join(["\n%s: %s" % (name, headers.get(name)) for name in names])
+
+    def _request_slot(self, key, request):
+        """the slot of the variant the request selects, the lock must be held"""
+        names = self.variants.get(key)
+
+        if not names or request is None:
+            return key
+
+        return self._variant(key, names, dict([(name.lower(), value) for name, value in request.headers.items()]))
+
+    def _page_slot(self, page):
+        return self._variant(page.key, sorted(page.vary), page.vary) if page.vary else page.key
+
+    def _use(self, page):
+        if self.policy == EVICT_LFU:
+            if page.uses:
+                bucket = self.buckets[page.uses]
+                del bucket[page.slot]
+
+                if not bucket:
+                    del self.buckets[page.uses]
+
+                    if self.min_uses == page.uses:
+                        self.min_uses += 1
+            else:
+                self.min_uses = 1
+
+            page.uses += 1
+
+            self.buckets.setdefault(page.uses, OrderedDict())[page.slot] = None
+        else:
+            page.uses += 1
+
+            del self.pages[page.slot]
+            self.pages[page.slot] = page
+
+    def _remove(self, slot):
+        page = self.pages.pop(slot)
+
+        self.size -= page.size
+
+        if self.policy == EVICT_LFU:
+            bucket = self.buckets[page.uses]
+            del bucket[slot]
+
+            if not bucket:
+                del self.buckets[page.uses]
+
+        page.size = page.uses = 0
+        page.slot = None
+
+    def _victim(self, keep):
+        """the page to evict, the one just updated only if it's alone"""
+        if self.policy == EVICT_LFU:
+            if self.min_uses not in self.buckets:
+                self.min_uses = min(self.buckets)
+
+            for key in self.buckets[self.min_uses]:
+                if key != keep:
+                    return key
+
+            # only the page just updated has the fewest uses
+            for uses in sorted(self.buckets):
+                for key in self.buckets[uses]:
+                    if key != keep:
+                        return key
+        else:
+            for key in self.pages:
+                if key != keep:
+                    return key
+
+        return keep
+
+    def get(self, url, method, request=None):
+        key = self.key(method, url)
+
+        with self.lock:
+            slot = self._request_slot(key, request)
+            page = self.pages.get(slot)
+
+            if page is not None:
+                if page.evict_at and time.time() >= page.evict_at:
+                    self._remove(slot)
+                else:
+                    self._use(page)
+
+                    return page
+
+        return BasePage(self, key)
+
+    def update(self, page):
+        with self.lock:
+            slot = self._page_slot(page)
+
+            if page.vary:
+                self.variants[page.key] = sorted(page.vary)
+            else:
+                self.variants.pop(page.key, None)
+
+            if page.slot is not None and page.slot != slot and self.pages.get(page.slot) is page:
+                # the stored response varies on other headers than the one it replaced
+                self._remove(page.slot)
+
+            if self.pages.get(slot) is not page:
+                if slot in self.pages:
+                    self._remove(slot)
+
+                page.slot = slot
+                self.pages[slot] = page
+                self._use(page)
+
+            self.size -= page.size
+            page.size = page_size(page)
+            self.size += page.size
+            page.evict_at = time.time() + self.ttl if self.ttl else None
+
+            while self.pages and ((self.max_pages and len(self.pages) > self.max_pages) or
+                                  (self.max_bytes and self.size > self.max_bytes)):
+                self._remove(self._victim(slot))
+                self.evictions += 1
+
+class MemcachePageCache(BasePageCache):
+    """
+    Page cache on memcached servers, which the processes of a crawl can share
+
+    The pages are stored as compact binary records under the SHA-1 of their
+    cache key, which fits the key length limit of memcached whatever the URL.
+    prefetch() loads the pages of a batch of URLs in a single round trip, they
+    are served for prefetch_ttl seconds and at most max_prefetched of them
+    are kept, and each thread talks to the servers on its own connections.
+
+    >>> cache = MemcachePageCache(['127.0.0.1:11211'])
+    >>> cache.prefetch(['http://www.google.com/', 'http://www.bing.com/'])
+    """
+    KEY_PREFIX = 'urllib4:'
+
+    RECORD_VERSION = 1
+    RECORD_HEADER = struct.Struct('!BBHd')
+    FIELD_LENGTH = struct.Struct('!i')
+
+    FLAG_STORED = 1
+    FLAG_EXPIRES = 2
+
+    PREFETCH_TTL = 10
+    MAX_PREFETCHED = 10000
+
+    def __init__(self, servers, debug=False, prefetch_ttl=PREFETCH_TTL, max_prefetched=MAX_PREFETCHED):
+        BasePageCache.__init__(self)
+
+        self.servers = servers
+        self.debug = debug
+        self.prefetch_ttl = prefetch_ttl
+        self.max_prefetched = max_prefetched
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.prefetched = OrderedDict() # key -> (page, expires), in the order of prefetch
+
+    @property
+    def mc(self):
+        """the memcached client of the current thread"""
+        mc = getattr(self.local, 'mc', None)
+
+        if mc is None:
+            mc = self.local.mc = memcache.Client(self.servers, debug=1 if self.debug else 0)
+
+        return mc
+
+    def hashed_key(self, key):
+        return self.KEY_PREFIX + hashlib.sha1(key).hexdigest()
+
+    @classmethod
+    def dumps(cls, page):
+        stored = page.body is not None
+        flags = (cls.FLAG_STORED if stored else 0) | \
+                (cls.FLAG_EXPIRES if stored and page.expires is not None else 0)
+
+        vary = None
+
+        if stored and page.vary:
+            vary = '\0'.join([name if value is None else "%s:%s" % (name, value)
+                              for name, value in page.vary.items()])
+
+        fields = [page.md5, page.etag, page.last_modified,
+                  '\0'.join(page.header) if stored else None, vary]
+
+        data = [cls.RECORD_HEADER.pack(cls.RECORD_VERSION, flags,
+                                       page.code or 0 if stored else 0,
+                                       page.expires or 0 if flags & cls.FLAG_EXPIRES else 0)]
+
+        for field in fields:
+            if field is None:
+                data.append(cls.FIELD_LENGTH.pack(-1))
+            else:
+                data.append(cls.FIELD_LENGTH.pack(len(field)))
+                data.append(field)
+
+        if stored:
+            data.append(page.body[:])
+
+        return ''.join(data)
+
+    def loads(self, key, data):
+        """
+        Decode a record, the page is empty if it can't be decoded
+        """
+        page = BasePage(self, key)
+
+        try:
+            version, flags, code, expires = self.RECORD_HEADER.unpack_from(data)
+
+            if version != self.RECORD_VERSION:
+                return page
+
+            offset = self.RECORD_HEADER.size
+            fields = []
+
+            for i in range(5):
+                length, = self.FIELD_LENGTH.unpack_from(data, offset)
+                offset += self.FIELD_LENGTH.size
+
+                if length < 0:
+                    fields.append(None)
+                else:
+                    fields.append(data[offset:offset+length])
+                    offset += length
+        except struct.error:
+            return page
+
+        md5, etag, last_modified, header, vary = fields
+
+        page.md5 = md5
+        page.etag = etag
+        page.last_modified = last_modified
+
+        if flags & self.FLAG_STORED:
+            page.code = code
+            page.header = header.split('\0') if header else []
+            page.body = data[offset:]
+            page.expires = expires if flags & self.FLAG_EXPIRES else None
+
+            if vary is not None:
+                page.vary = {}
+
+                for line in vary.split('\0'):
+                    name, sep, value = line.partition(':')
+                    page.vary[name] = value if sep else None
+
+        return page
+
+    def prefetch(self, urls, method='GET'):
+        """
+        Load the pages of the URLs in a single round trip, for the next get() of each
+
+        @return the number of pages found
+        """
+        keys = dict([(self.hashed_key(self.key(method, url)), self.key(method, url)) for url in urls])
+        records = self.mc.get_multi(keys.keys())
+        expires = time.time() + self.prefetch_ttl
+
+        with self.lock:
+            for hashed_key, key in keys.items():
+                data = records.get(hashed_key)
+
+                self.prefetched.pop(key, None)
+                self.prefetched[key] = (self.loads(key, data) if data else None, expires)
+
+            while len(self.prefetched) > self.max_prefetched:
+                self.prefetched.popitem(last=False)
+
+        return len(records)
+
+    def get(self, url, method, request=None):
+        key = self.key(method, url)
+
+        with self.lock:
+            page, expires = self.prefetched.pop(key, (None, None))
+
+        if expires is not None and time.time() < expires:
+            return page or BasePage(self, key)
+
+        data = self.mc.get(self.hashed_key(key))
+
+        return self.loads(key, data) if data else BasePage(self, key)
+
+    def update(self, page):
+        with self.lock:
+            self.prefetched.pop(page.key, None)
+
+        self.mc.set(self.hashed_key(page.key), self.dumps(page))
+
+    def update_many(self, pages):
+        with self.lock:
+            for page in pages:
+                self.prefetched.pop(page.key, None)
+
+        self.mc.set_multi(dict([(self.hashed_key(page.key), self.dumps(page)) for page in pages]))
+
+class DiskPageCache(BasePageCache):
+    """
+    Page cache which keeps the bodies in content addressed files
+
+    A body is stored once in objects/<md5[:2]>/<md5>, however many pages
+    share it, and a hit on a body above mmap_threshold bytes maps the file
+    instead of reading it. The metadata of
+    the pages is appended to an index file, which is replayed on open and
+    compacted once most of its records are superseded.
+    """
+    INDEX_NAME = 'index'
+
+    # a mapped body holds a file descriptor as long as the page lives
+    MMAP_THRESHOLD = 1024 * 1024
+
+    def __init__(self, directory, mmap_threshold=MMAP_THRESHOLD):
+        BasePageCache.__init__(self)
+
+        self.directory = directory
+        self.mmap_threshold = mmap_threshold
+        self.lock = threading.Lock()
+        self.index = {}
+        self.refs = {}
+        self.records = 0
+
+        if not os.path.isdir(os.path.join(directory, 'objects')):
+            os.makedirs(os.path.join(directory, 'objects'))
+
+        self._load()
+
+        self.log = open(os.path.join(directory, self.INDEX_NAME), 'ab')
+
+    def __len__(self):
+        return len(self.index)
+
+    def _path(self, md5):
+        return os.path.join(self.directory, 'objects', md5[:2], md5)
+
+    def _load(self):
+        try:
+            file = open(os.path.join(self.directory, self.INDEX_NAME), 'rb')
+        except IOError:
+            return
+
+        with file:
+            for line in file:
+                try:
+                    key, meta = json.loads(line)
+                except ValueError:
+                    continue # a record torn by a crash
+
+                self._set(key.encode('utf-8'), meta)
+                self.records += 1
+
+    def _set(self, key, meta):
+        old = self.index.pop(key, None)
+
+        if old and old.get('object'):
+            self.refs[old['object']] -= 1
+
+        if meta is not None:
+            self.index[key] = meta
+
+            if meta.get('object'):
+                self.refs[meta['object']] = self.refs.get(meta['object'], 0) + 1
+
+        # remove the body which no page refers to anymore
+        if old and old.get('object') and not self.refs[old['object']]:
+            del self.refs[old['object']]
+
+            try:
+                os.remove(self._path(old['object']))
+            except OSError:
+                pass
+
+    def _compact(self):
+        path = os.path.join(self.directory, self.INDEX_NAME)
+        fd, temp = mkstemp(dir=self.directory)
+
+        with os.fdopen(fd, 'wb') as file:
+            for key, meta in self.index.items():
+                file.write(json.dumps([key, meta]) + '\n')
+
+        os.rename(temp, path)
+
+        self.log.close()
+        self.log = open(path, 'ab')
+        self.records = len(self.index)
+
+    def get(self, url, method, request=None):
+        key = self.key(method, url)
+
+        with self.lock:
+            meta = self.index.get(key)
+
+        page = BasePage(self, key)
+
+        if meta:
+            page.md5, page.etag, page.last_modified = [meta[k].encode('utf-8') if meta.get(k) else meta.get(k)
+                                                       for k in ['md5', 'etag', 'last_modified']]
+
+            if meta.get('object'):
+                try:
+                    with open(self._path(meta['object']), 'rb') as file:
+                        size = os.fstat(file.fileno()).st_size
+
+                        if size > self.mmap_threshold:
+                            page.body = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                        else:
+                            page.body = file.read()
+                except (IOError, OSError, ValueError):
+                    return page
+
+                page.code = meta['code']
+                page.header = [line.encode('utf-8') for line in meta['header']]
+                page.expires = meta.get('expires')
+                page.vary = meta.get('vary')
+
+        return page
+
+    def update(self, page):
+        meta = {
+            'md5': page.md5,
+            'etag': page.etag,
+            'last_modified': page.last_modified,
+        }
+
+        temp = None
+
+        if page.body is not None:
+            meta['object'] = page.md5 or hashlib.md5(page.body).hexdigest()
+
+            path = self._path(meta['object'])
+
+            if not os.path.exists(path):
+                temp = self._write_object(path, page.body)
+
+            meta.update({
+                'code': page.code,
+                'header': page.header,
+                'expires': page.expires,
+                'vary': page.vary,
+            })
+
+        with self.lock:
+            # the object may have been removed, or written by another thread, meanwhile
+            if page.body is not None and not os.path.exists(path):
+                os.rename(temp or self._write_object(path, page.body), path)
+            elif temp:
+                os.remove(temp)
+
+            self._set(page.key, meta)
+
+            self.log.write(json.dumps([page.key, meta]) + '\n')
+            self.log.flush()
+            self.records += 1
+
+            if self.records > 2 * len(self.index) + 1024:
+                self._compact()
+
+    def _write_object(self, path, body):
+        """@return the temporary file of the object, to be renamed to its path"""
+        if not os.path.isdir(os.path.dirname(path)):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:
+                pass # created by another thread
+
+        fd, temp = mkstemp(dir=os.path.dirname(path))
+
+        with os.fdopen(fd, 'wb') as file:
+            file.write(body)
+
+        return temp
+
+    def close(self):
+        self.log.close()
+
+def _empty(page):
+    return page.body is None and not (page.md5 or page.etag or page.last_modified)
+
+class TieredPageCache(BasePageCache):
+    """
+    Page cache in front of a slower one, like a bounded DictPageCache before memcached
+
+    A lookup which misses the first tier reads through to the second one and
+    promotes the page it finds. The updates are applied to the first tier at
+    once and written behind to the second one by a background thread, which
+    sends the pages of the same key only once and in batches of batch_size.
+
+    >>> cache = TieredPageCache(DictPageCache(max_pages=10000), MemcachePageCache(['127.0.0.1:11211']))
+    >>> HttpClient(pagecache=cache).get('http://www.google.com/')
+    """
+    def __init__(self, l1, l2, write_behind=True, batch_size=64, flush_interval=0.1):
+        BasePageCache.__init__(self)
+
+        self.l1 = l1
+        self.l2 = l2
+        self.write_behind = write_behind
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self.lock = threading.Condition()
+        self.pending = OrderedDict()
+        self.writing = 0
+        self.flushing = 0
+        self.writer = None
+        self.terminated = False
+
+        self.l1_hits = 0
+        self.l2_hits = 0
+        self.lookups = 0
+        self.writes = 0
+
+    @property
+    def l1_hit_rate(self):
+        return float(self.l1_hits) / self.lookups if self.lookups else 0.0
+
+    @property
+    def l2_hit_rate(self):
+        """the part of the lookups which missed the first tier and hit the second one"""
+        return float(self.l2_hits) / (self.lookups - self.l1_hits) if self.lookups > self.l1_hits else 0.0
+
+    def get(self, url, method, request=None):
+        page = self.l1.get(url, method, request)
+
+        with self.lock:
+            self.lookups += 1
+
+            if _empty(page):
+                # a page evicted from the first tier may not be written to the second one yet
+                page = self.pending.get(page.key) or page
+
+            if not _empty(page):
+                self.l1_hits += 1
+
+        if _empty(page):
+            page = self.l2.get(url, method, request)
+
+            if not _empty(page):
+                with self.lock:
+                    self.l2_hits += 1
+
+                if isinstance(page.body, mmap.mmap):
+                    # the first tier keeps the page, not the file it's mapped from
+                    page.body = page.body[:]
+
+                self.l1.update(page)
+
+        page.cache = self
+
+        return page
+
+    def update(self, page):
+        self.l1.update(page)
+
+        with self.lock:
+            if self.write_behind and not self.terminated:
+                self.pending.pop(page.key, None)
+                self.pending[page.key] = page
+
+                if self.writer is None:
+                    self.writer = threading.Thread(target=self._write, name="pagecache")
+                    self.writer.setDaemon(True)
+                    self.writer.start()
+
+                self.lock.notifyAll()
+
+                return
+
+        # once closed, there's no writer thread anymore and the update is written through
+        self.l2.update(page)
+
+        with self.lock:
+            self.writes += 1
+
+    def _write(self):
+        while True:
+            with self.lock:
+                while not self.pending and not self.terminated:
+                    self.lock.wait()
+
+                # wait a little for a batch to fill up, unless the pages are flushed
+                deadline = time.time() + self.flush_interval
+
+                while len(self.pending) < self.batch_size and not self.terminated and not self.flushing:
+                    timeout = deadline - time.time()
+
+                    if timeout <= 0:
+                        break
+
+                    self.lock.wait(timeout)
+
+                if not self.pending and self.terminated:
+                    return
+
+                pages = []
+
+                while self.pending and len(pages) < self.batch_size:
+                    pages.append(self.pending.popitem(last=False)[1])
+
+                self.writing += 1
+
+            try:
+                self.l2.update_many(pages)
+            except:
+                import traceback
+
+                traceback.print_exc()
+            finally:
+                with self.lock:
+                    self.writing -= 1
+                    self.writes += len(pages)
+                    self.lock.notifyAll()
+
+    def flush(self):
+        """wait until the pending updates were written to the second tier"""
+        with self.lock:
+            self.flushing += 1
+            self.lock.notifyAll()
+
+            try:
+                while self.pending or self.writing:
+                    self.lock.wait()
+            finally:
+                self.flushing -= 1
+
+    def close(self):
+        self.flush()
+
+        with self.lock:
+            self.terminated = True
+            self.lock.notifyAll()
+
+        if self.writer:
+            self.writer.join()
+            self.writer = None
@@ -1,137 +1,363 @@
-#!/usr/bin/env python
-from __future__ import with_statement
-
-import threading
-from Queue import Queue
-
-import pycurl
-
-class Dispatcher(object):
-    def __init__(self, concurrency=2):
-        self.terminated = False
-        self.tasks = Queue()
-
-        self.workers = [threading.Thread(target=lambda: self.work(), name="dispatcher") for i in range(concurrency)]
-
-        for worker in self.workers:
-            worker.setDaemon(True)
-            worker.start()
-
-    def terminate(self):
-        self.terminated = True
-
-    def dispatch(self, callback, *args, **kwds):
-        if len(self.workers) > 0:
-            self.tasks.put((callback, args, kwds))
-        else:
-            try:
-                callback(*args, **kwds)
-            except:
-                import traceback
-
-                traceback.print_exc()
-
-    def work(self):
-        while True:
-            callback, args, kwds = self.tasks.get()
-
-            try:
-                callback(*args, **kwds)
-            except:
-                import traceback
-
-                traceback.print_exc()
-
-            self.tasks.task_done()
-
-class HttpPipeline(threading.Thread):
-    def __init__(self, dispatcher=None, concurrency=None, loop_interval=1.0):
-        threading.Thread.__init__(self, name="pipeline")
-
-        self.setDaemon(True)
-
-        self.dispatcher = dispatcher
-
-        if self.dispatcher is None:
-            if concurrency is None:
-                self.dispatcher = Dispatcher()
-            else:
-                self.dispatcher = Dispatcher(concurrency)
-
-        self.loop_interval = loop_interval
-        self.pipeline = pycurl.CurlMulti()
-        self.clients = {}
-        self.lock = threading.RLock()
-
-        self.terminated = False
-
-    def close(self):
-        self.pipeline.close()
-
-    def terminate(self):
-        self.terminated = True
-
-    def __enter__(self):
-        return self
-
-    def __exit__(self, exc_type, exc_value, traceback):
-        self.close()
-
-    def add(self, client, callback):
-        with self.lock:
-            self.clients[client.curl] = (client, callback)
-
-            self.pipeline.add_handle(client.curl)
-
-            return client
-
-    def remove(self, client):
-        with self.lock:
-            client, callback = self.clients[client.curl]
-
-            del self.clients[client.curl]
-
-            self.pipeline.remove_handle(client.curl)
-
-            return client, callback
-
-    def run(self):
-        while not self.terminated:
-            while not self.terminated:
-                ret, num_handles = self.pipeline.perform()
-
-                if ret != pycurl.E_CALL_MULTI_PERFORM:
-                    break
-
-            while not self.terminated:
-                num_queued, ok_list, err_list = self.pipeline.info_read()
-
-                for curl in ok_list:
-                    with self.lock:
-                        client, callback = self.clients[curl]
-
-                        self.remove(client)
-
-                    self.dispatcher.dispatch(callback, client, 0, None)
-
-                for curl, errno, errmsg in err_list:
-                    with self.lock:
-                        client, callback = self.clients[curl]
-
-                        self.remove(client)
-
-                    self.dispatcher.dispatch(callback, client, errno, errmsg)
-
-                if num_queued == 0:
-                    break
-
-            self.pipeline.select(self.loop_interval)
-
-__pipeline = None
-
-def get_default_pipeline():
-    if __pipeline is None:
-        __pipeline = HttpPipeline()
-        __pipeline.start()
-
-    return __pipeline
+#!/usr/bin/env python
+from __future__ import with_statement
+
+import os
+import errno
+import fcntl
+import select
+import time
+import threading
+from Queue import Queue
+from collections import deque
+
+import pycurl
+
+class Dispatcher(object):
+    def __init__(self, concurrency=2):
+        self.terminated = False
+        self.tasks = Queue()
+
+        self.workers = [threading.Thread(target=lambda: self.work(), name="dispatcher") for i in range(concurrency)]
+
+        for worker in self.workers:
+            worker.setDaemon(True)
+            worker.start()
+
+    def terminate(self):
+        self.terminated = True
+
+    def dispatch(self, callback, *args, **kwds):
+        if len(self.workers) > 0:
+            self.tasks.put((callback, args, kwds))
+        else:
+            try:
+                callback(*args, **kwds)
+            except:
+                import traceback
+
+                traceback.print_exc()
+
+    def work(self):
+        while True:
+            callback, args, kwds = self.tasks.get()
+
+            try:
+                callback(*args, **kwds)
+            except:
+                import traceback
+
+                traceback.print_exc()
+
+            self.tasks.task_done()
+
+class HttpPipeline(threading.Thread):
+    def __init__(self, dispatcher=None, concurrency=None, loop_interval=1.0, share=None):
+        threading.Thread.__init__(self, name="pipeline")
+
+        self.setDaemon(True)
+
+        self.dispatcher = dispatcher
+
+        if self.dispatcher is None:
+            if concurrency is None:
+                self.dispatcher = Dispatcher()
+            else:
+                self.dispatcher = Dispatcher(concurrency)
+
+        self.loop_interval = loop_interval
+        self.share = share
+        self.pipeline = pycurl.CurlMulti()
+        self.clients = {}
+        self.lock = threading.RLock()
+
+        self.terminated = False
+
+    def close(self):
+        self.pipeline.close()
+
+    def terminate(self):
+        self.terminated = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _attach(self, client):
+        # the share group of the client wins over the one of the pipeline
+        if self.share is not None and client.share is None:
+            self.share.attach(client.curl)
+
+    def add(self, client, callback):
+        self._attach(client)
+
+        with self.lock:
+            self.clients[client.curl] = (client, callback)
+
+            self.pipeline.add_handle(client.curl)
+
+            return client
+
+    def remove(self, client):
+        with self.lock:
+            client, callback = self.clients[client.curl]
+
+            del self.clients[client.curl]
+
+            self.pipeline.remove_handle(client.curl)
+
+            return client, callback
+
+    def _read_info(self):
+        while not self.terminated:
+            num_queued, ok_list, err_list = self.pipeline.info_read()
+
+            for curl in ok_list:
+                with self.lock:
+                    client, callback = self.clients[curl]
+
+                    self.remove(client)
+
+                self.dispatcher.dispatch(callback, client, 0, None)
+
+            for curl, code, errmsg in err_list:
+                with self.lock:
+                    client, callback = self.clients[curl]
+
+                    self.remove(client)
+
+                self.dispatcher.dispatch(callback, client, code, errmsg)
+
+            if num_queued == 0:
+                break
+
+    def run(self):
+        while not self.terminated:
+            # the handles are added by other threads, which curl refuses while it performs
+            with self.lock:
+                while not self.terminated:
+                    ret, num_handles = self.pipeline.perform()
+
+                    if ret != pycurl.E_CALL_MULTI_PERFORM:
+                        break
+
+                self._read_info()
+
+            self.pipeline.select(self.loop_interval)
+
+class Poller(object):
+    """
+    Wrap epoll (or poll where epoll is unavailable) behind a single interface
+
+    The timeout of poll() is always in seconds, None means wait forever.
+    """
+    def __init__(self):
+        if hasattr(select, 'epoll'):
+            self.poller = select.epoll()
+            self.READ, self.WRITE, self.ERROR = select.EPOLLIN, select.EPOLLOUT, select.EPOLLERR | select.EPOLLHUP
+        else:
+            self.poller = select.poll()
+            self.READ, self.WRITE, self.ERROR = select.POLLIN, select.POLLOUT, select.POLLERR | select.POLLHUP
+
+    def register(self, fd, events):
+        self.poller.register(fd, events)
+
+    def modify(self, fd, events):
+        self.poller.modify(fd, events)
+
+    def unregister(self, fd):
+        try:
+            self.poller.unregister(fd)
+        except (IOError, OSError, KeyError, ValueError):
+            # curl may have closed the socket before telling us to forget it
+            pass
+
+    def poll(self, timeout=None):
+        if hasattr(select, 'epoll') and type(self.poller) == select.epoll:
+            return self.poller.poll(-1 if timeout is None else timeout)
+
+        return self.poller.poll(None if timeout is None else int(timeout * 1000))
+
+    def close(self):
+        if hasattr(self.poller, 'close'):
+            self.poller.close()
+
+class SocketPipeline(HttpPipeline):
+    """
+    Event driven pipeline which drives the multi handle with socket_action
+
+    curl tells us which sockets it is interested in through M_SOCKETFUNCTION
+    and when it wants to be woken up through M_TIMERFUNCTION, so each loop
+    iteration only services the sockets which are ready instead of every
+    handle, and a completion is dispatched as soon as its socket fires rather
+    than at the next loop_interval tick.
+
+    Handles added from other threads are queued and handed to curl by the
+    pipeline thread, which is woken up through a pipe; a handle removed by
+    another thread waits for the lock the pipeline thread holds while it
+    drives the multi handle.
+    """
+    def __init__(self, dispatcher=None, concurrency=None, loop_interval=1.0, share=None):
+        HttpPipeline.__init__(self, dispatcher, concurrency, loop_interval, share)
+
+        self.poller = Poller()
+        self.sockets = {}
+        self.pending = deque()
+        self.deadline = None
+
+        self.waker, self.waker_notify = os.pipe()
+
+        for fd in [self.waker, self.waker_notify]:
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+        self.poller.register(self.waker, self.poller.READ)
+
+        self.pipeline.setopt(pycurl.M_SOCKETFUNCTION, self._socket_callback)
+        self.pipeline.setopt(pycurl.M_TIMERFUNCTION, self._timer_callback)
+
+    def close(self):
+        HttpPipeline.close(self)
+
+        self.poller.close()
+
+        os.close(self.waker)
+        os.close(self.waker_notify)
+
+    def terminate(self):
+        HttpPipeline.terminate(self)
+
+        self._wakeup()
+
+    def _wakeup(self):
+        try:
+            os.write(self.waker_notify, 'x')
+        except OSError, e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def add(self, client, callback):
+        self._attach(client)
+
+        with self.lock:
+            self.clients[client.curl] = (client, callback)
+
+            self.pending.append(client.curl)
+
+        self._wakeup()
+
+        return client
+
+    def remove(self, client):
+        with self.lock:
+            client, callback = self.clients[client.curl]
+
+            del self.clients[client.curl]
+
+            if client.curl in self.pending:
+                self.pending.remove(client.curl)
+            else:
+                self.pipeline.remove_handle(client.curl)
+
+            return client, callback
+
+    def _socket_callback(self, event, fd, multi, data):
+        if event == pycurl.POLL_REMOVE:
+            if fd in self.sockets:
+                del self.sockets[fd]
+
+                self.poller.unregister(fd)
+        else:
+            mask = self.poller.ERROR
+
+            if event & pycurl.POLL_IN:
+                mask |= self.poller.READ
+
+            if event & pycurl.POLL_OUT:
+                mask |= self.poller.WRITE
+
+            if fd in self.sockets:
+                self.poller.modify(fd, mask)
+            else:
+                self.poller.register(fd, mask)
+
+            self.sockets[fd] = mask
+
+    def _timer_callback(self, timeout_ms):
+        if timeout_ms < 0:
+            self.deadline = None
+        else:
+            self.deadline = time.time() + timeout_ms / 1000.0
+
+    def _socket_action(self, fd, mask):
+        # remove() may take a handle out of the multi handle from another thread
+        with self.lock:
+            while True:
+                ret, num_handles = self.pipeline.socket_action(fd, mask)
+
+                if ret != pycurl.E_CALL_MULTI_PERFORM:
+                    break
+
+    def _add_pending(self):
+        while True:
+            with self.lock:
+                if not self.pending:
+                    break
+
+                curl = self.pending.popleft()
+
+                self.pipeline.add_handle(curl)
+
+    def _poll_timeout(self):
+        if self.deadline is None:
+            return self.loop_interval
+
+        return max(0, min(self.loop_interval, self.deadline - time.time()))
+
+    def run(self):
+        while not self.terminated:
+            self._add_pending()
+
+            for fd, event in self.poller.poll(self._poll_timeout()):
+                if fd == self.waker:
+                    try:
+                        while os.read(self.waker, 4096):
+                            pass
+                    except OSError:
+                        pass
+
+                    continue
+
+                mask = 0
+
+                if event & self.poller.READ:
+                    mask |= pycurl.CSELECT_IN
+
+                if event & self.poller.WRITE:
+                    mask |= pycurl.CSELECT_OUT
+
+                if event & self.poller.ERROR:
+                    mask |= pycurl.CSELECT_ERR
+
+                self._socket_action(fd, mask)
+
+            if self.deadline is not None and self.deadline <= time.time():
+                self.deadline = None
+
+                self._socket_action(pycurl.SOCKET_TIMEOUT, 0)
+
+            with self.lock:
+                self._read_info()
+
+__pipeline = None
+__pipeline_lock = threading.Lock()
+
+def get_default_pipeline():
+    global __pipeline
+
+    with __pipeline_lock:
+        if __pipeline is None:
+            __pipeline = HttpPipeline()
+            __pipeline.start()
+
+    return __pipeline
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+from __future__ import with_statement
+
+import math
+import time
+import threading
+
+from concurrent.futures import wait
+
+from request import HttpRequest
+from adapter import _Batch
+
+# change rate of a page which wasn't visited twice yet, per second
+DEFAULT_CHANGE_RATE = 1.0 / 86400
+# bounds of the interval between the visits of a page
+MIN_INTERVAL = 60
+MAX_INTERVAL = 30 * 86400
+
+class PageHistory(object):
+    """Changes observed on the visits of a page"""
+    __slots__ = ['url', 'visits', 'changes', 'elapsed', 'last_visit', 'last_change', 'errors']
+
+    def __init__(self, url):
+        self.url = url
+        self.visits = 0 # the visits after the first one
+        self.changes = 0
+        self.elapsed = 0.0 # seconds between the first and the last visit
+        self.last_visit = None
+        self.last_change = None
+        self.errors = 0
+
+    def observe(self, changed, now=None):
+        if now is None:
+            now = time.time()
+
+        if self.last_visit is not None:
+            self.visits += 1
+            self.elapsed += now - self.last_visit
+
+            if changed:
+                self.changes += 1
+                self.last_change = now
+
+        self.last_visit = now
+
+    def change_rate(self):
+        """
+        The changes per second, or None before a second visit
+
+        A visit only tells whether the page changed since the previous one,
+        not how many times, so the rate is estimated from the visits which
+        saw a change as proposed by Cho and Garcia-Molina, which stays finite
+        when every visit did.
+
+        >>> history = PageHistory('http://www.google.com/')
+        >>> for now in [0, 100, 200, 300, 400]: history.observe(now > 200, now)
+        >>> round(history.change_rate() * 100, 3)
+        0.588
+        """
+        if not self.visits or self.elapsed <= 0:
+            return None
+
+        return -math.log((self.visits - self.changes + 0.5) / (self.visits + 0.5)) / (self.elapsed / self.visits)
+
+    def __repr__(self):
+        return "<%s url=%s, visits=%d, changes=%d, rate=%s>" % \
+            (self.__class__.__name__, self.url, self.visits, self.changes, self.change_rate())
+
+class RecrawlScheduler(object):
+    """
+    Schedule of the conditional requests which keep the page cache up to date
+
+    Each recrawl() revalidates the pages which are due, the most likely to
+    have changed first and at most budget of them, in a batch on one
+    pipeline. A 304, or a body with the same md5, is a visit which saw no
+    change, and the change rate estimated from the visits sets when the page
+    is due again, between min_interval and max_interval.
+
+    >>> scheduler = RecrawlScheduler(DictPageCache())
+    >>> scheduler.add('http://www.google.com/')
+    >>> scheduler.recrawl(budget=100)
+    """
+    def __init__(self, pagecache, pipeline=None, concurrency=10,
+                 default_rate=DEFAULT_CHANGE_RATE, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL, **kwds):
+        self.pagecache = pagecache
+        self.pipeline = pipeline
+        self.concurrency = concurrency
+        self.default_rate = default_rate
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.kwds = kwds
+
+        self.lock = threading.Lock()
+        self.histories = {}
+
+    def add(self, url):
+        with self.lock:
+            if url not in self.histories:
+                self.histories[url] = PageHistory(url)
+
+            return self.histories[url]
+
+    def observe(self, url, changed, now=None):
+        self.add(url).observe(changed, now)
+
+    def rate(self, history):
+        rate = history.change_rate()
+
+        return self.default_rate if rate is None else rate
+
+    def interval(self, history):
+        """seconds from a visit of the page to the next one"""
+        rate = self.rate(history)
+
+        return min(max(1.0 / rate if rate > 0 else self.max_interval, self.min_interval), self.max_interval)
+
+    def change_probability(self, history, now=None):
+        """the probability the page changed since its last visit"""
+        if history.last_visit is None:
+            return 1.0
+
+        if now is None:
+            now = time.time()
+
+        return 1.0 - math.exp(-self.rate(history) * max(0, now - history.last_visit))
+
+    def schedule(self, budget=None, now=None):
+        """
+        @return the URLs due for a visit, the most likely to have changed first
+        """
+        if now is None:
+            now = time.time()
+
+        with self.lock:
+            due = [(self.change_probability(history, now), url) for url, history in self.histories.items()
+                   if history.last_visit is None or now >= history.last_visit + self.interval(history)]
+
+        due.sort(reverse=True)
+
+        return [url for probability, url in due[:budget]]
+
+    def recrawl(self, budget=None, now=None):
+        """
+        Revalidate the pages which are due
+
+        @return the responses of the visited URLs, a failed one is skipped
+        """
+        if now is None:
+            now = time.time()
+
+        urls = self.schedule(budget, now)
+        responses = {}
+
+        kwds = dict(self.kwds)
+        kwds['pagecache'] = self.pagecache
+
+        with _Batch(self.pipeline, kwds) as batch:
+            futures = {}
+
+            for i in range(0, len(urls), self.concurrency):
+                for url in urls[i:i+self.concurrency]:
+                    # the cached page must not answer its own revalidation
+                    futures[url] = batch.submit(HttpRequest(url, headers={'Cache-Control': 'max-age=0'}))
+
+                wait([futures[url] for url in urls[i:i+self.concurrency]])
+
+        for url, future in futures.items():
+            history = self.add(url)
+
+            if future.exception() is None and future.result().code in (200, 304):
+                responses[url] = future.result()
+
+                history.observe(responses[url].code == 200, now)
+            else:
+                history.errors += 1
+
+        return responses
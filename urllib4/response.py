@@ -1,157 +1,344 @@
-#!/usr/bin/env python
-import socket
-import logging
-
-try:
-    from gurl import Url
-    urlparse = Url
-except ImportError:
-    from urlparse import urlparse
-
-try:
-    from cStringIO import StringIO
-except ImportError:
-    from StringIO import StringIO
-
-import pycurl
-
-class HttpResponse(object):
-    BUILDIN_FIELDS = {
-            'url': pycurl.EFFECTIVE_URL,
-            'response_code': pycurl.RESPONSE_CODE,
-            'connect_code': pycurl.HTTP_CONNECTCODE,
-
-            # = Time =
-            #
-            # An overview of the six time values available from curl_easy_getinfo()
-            #
-            # curl_easy_perform()
-            #     |
-            #     |--NAMELOOKUP
-            #     |--|--CONNECT
-            #     |--|--|--APPCONNECT
-            #     |--|--|--|--PRETRANSFER
-            #     |--|--|--|--|--STARTTRANSFER
-            #     |--|--|--|--|--|--TOTAL
-            #     |--|--|--|--|--|--REDIRECT
-
-            'namelookup_time': pycurl.NAMELOOKUP_TIME,
-            'connect_time': pycurl.CONNECT_TIME,
-            #'appconnect_time': pycurl.APPCONNECT_TIME,
-            'pretransfer_time': pycurl.PRETRANSFER_TIME,
-            'starttransfer_time': pycurl.STARTTRANSFER_TIME,
-            'total_time': pycurl.TOTAL_TIME,
-            'redirect_time': pycurl.REDIRECT_TIME,
-
-            'redirect_count': pycurl.REDIRECT_COUNT,
-            'redirect_url': pycurl.REDIRECT_URL,
-
-            'size_upload': pycurl.SIZE_UPLOAD,
-            'size_download': pycurl.SIZE_DOWNLOAD,
-            'speed_upload': pycurl.SPEED_UPLOAD,
-            'speed_download': pycurl.SPEED_DOWNLOAD,
-            'header_size': pycurl.HEADER_SIZE,
-            'request_size': pycurl.REQUEST_SIZE,
-
-            'ssl_verify_result': pycurl.SSL_VERIFYRESULT,
-            'ssl_engines': pycurl.SSL_ENGINES,
-
-            'content_length_upload': pycurl.CONTENT_LENGTH_UPLOAD,
-            'content_length_download': pycurl.CONTENT_LENGTH_DOWNLOAD,
-            'content_type': pycurl.CONTENT_TYPE,
-
-            'os_errno': pycurl.OS_ERRNO,
-            'num_connects': pycurl.NUM_CONNECTS,
-            #'primary_ip': pycurl.PRIMARY_IP,
-
-            'cookie_list': pycurl.INFO_COOKIELIST,
-            'last_socket': pycurl.LASTSOCKET,
-        }
-
-    def __init__(self, client, request, code=None):
-        self.client = client
-        self.request = request
-        self._code = code
-
-        self.body = StringIO()
-
-        for s in client.body:
-            self.body.write(s)
-
-        self.body.seek(0)
-
-        self.cached_headers = None
-
-    def _get_code(self):
-        return self._code or self.response_code
-
-    def _set_code(self, code):
-        self._code = code
-
-    code = property(_get_code, _set_code)
-
-    def __getattr__(self, name):
-
-        if name in ['__iter__', 'next', 'isatty', 'seek', 'tell',
-                    'read', 'readline', 'readlines', 'truncate',
-                    'write', 'writelines', 'flush']:
-            return getattr(self.body, name)
-        elif self.BUILDIN_FIELDS.has_key(name):
-            value = self.BUILDIN_FIELDS[name]
-
-            if callable(value):
-                return value()
-            elif type(value) == tuple:
-                field, convert = value
-
-                return convert(self.client.curl.getinfo(field))
-            else:
-                return self.client.curl.getinfo(value)
-
-        raise AttributeError(name)
-
-    def close(self):
-        pass
-
-    def geturl(self):
-        return self.url
-
-    @property
-    def primary_ip(self):
-        if hasattr(socket, "fromfd"):
-            if self.last_socket >= 0:
-                sock = socket.fromfd(self.last_socket, socket.AF_INET, socket.SOCK_STREAM)
-
-                if sock:
-                    return sock.getpeername()[0]
-
-        try:
-            domain = urlparse(self.url).hostname
-
-            if domain:
-                if self.client.dnscache:
-                    return self.client.dnscache.get(domain)
-                else:
-                    return socket.gethostbyname(domain) if domain else None
-        except socket.gaierror:
-            return None
-
-    @property
-    def headers(self):
-        from httplib import HTTPMessage
-
-        if not self.cached_headers:
-            header = StringIO(self.raw_headers)
-            try:
-                header.readline() # eat the first line 'HTTP/1.1 200 OK'
-                self.cached_headers = HTTPMessage(header)
-            finally:
-                header.close()
-
-        return self.cached_headers
-
-    info = headers
-
-    @property
-    def raw_headers(self):
-        return ''.join(self.client.header)
+#!/usr/bin/env python
+import socket
+import logging
+
+try:
+    from gurl import Url
+    urlparse = Url
+except ImportError:
+    from urlparse import urlparse
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+import pycurl
+
+from errors import PycurlError
+from buffer import RingBuffer, BodyBuffer
+
+class HttpResponse(object):
+    BUILDIN_FIELDS = {
+            'url': pycurl.EFFECTIVE_URL,
+            'response_code': pycurl.RESPONSE_CODE,
+            'connect_code': pycurl.HTTP_CONNECTCODE,
+
+            # = Time =
+            #
+            # An overview of the six time values available from curl_easy_getinfo()
+            #
+            # curl_easy_perform()
+            #     |
+            #     |--NAMELOOKUP
+            #     |--|--CONNECT
+            #     |--|--|--APPCONNECT
+            #     |--|--|--|--PRETRANSFER
+            #     |--|--|--|--|--STARTTRANSFER
+            #     |--|--|--|--|--|--TOTAL
+            #     |--|--|--|--|--|--REDIRECT
+
+            'namelookup_time': pycurl.NAMELOOKUP_TIME,
+            'connect_time': pycurl.CONNECT_TIME,
+            #'appconnect_time': pycurl.APPCONNECT_TIME,
+            'pretransfer_time': pycurl.PRETRANSFER_TIME,
+            'starttransfer_time': pycurl.STARTTRANSFER_TIME,
+            'total_time': pycurl.TOTAL_TIME,
+            'redirect_time': pycurl.REDIRECT_TIME,
+
+            'redirect_count': pycurl.REDIRECT_COUNT,
+            'redirect_url': pycurl.REDIRECT_URL,
+
+            'size_upload': pycurl.SIZE_UPLOAD,
+            'size_download': pycurl.SIZE_DOWNLOAD,
+            'speed_upload': pycurl.SPEED_UPLOAD,
+            'speed_download': pycurl.SPEED_DOWNLOAD,
+            'header_size': pycurl.HEADER_SIZE,
+            'request_size': pycurl.REQUEST_SIZE,
+
+            'ssl_verify_result': pycurl.SSL_VERIFYRESULT,
+            'ssl_engines': pycurl.SSL_ENGINES,
+
+            'content_length_upload': pycurl.CONTENT_LENGTH_UPLOAD,
+            'content_length_download': pycurl.CONTENT_LENGTH_DOWNLOAD,
+            'content_type': pycurl.CONTENT_TYPE,
+
+            'os_errno': pycurl.OS_ERRNO,
+            'num_connects': pycurl.NUM_CONNECTS,
+            #'primary_ip': pycurl.PRIMARY_IP,
+
+            'cookie_list': pycurl.INFO_COOKIELIST,
+            'last_socket': pycurl.LASTSOCKET,
+        }
+
+    # the lists which aren't about the transfer itself, they're too costly to copy for each response
+    UNSNAPSHOT_FIELDS = ('ssl_engines', 'cookie_list')
+
+    # the info of the finished transfer, the handle may serve another one since
+    transfer_info = None
+
+    def __init__(self, client, request, code=None):
+        self.client = client
+        self.request = request
+        self._code = code
+
+        # keep the buffers of this transfer, the client starts new ones for the next
+        self.header = client.header
+        self.content = client.body
+        self._body = None
+
+        self.cached_headers = None
+
+    @property
+    def body(self):
+        # the file object reads the buffer in place, so create it after the transfer
+        if self._body is None:
+            self._body = StringIO(self.content.getbuffer())
+
+        return self._body
+
+    def _get_code(self):
+        return self._code or self.response_code
+
+    def _set_code(self, code):
+        self._code = code
+
+    code = property(_get_code, _set_code)
+
+    def __getattr__(self, name):
+
+        if name in ['__iter__', 'next', 'isatty', 'seek', 'tell',
+                    'read', 'readline', 'readlines', 'truncate',
+                    'write', 'writelines', 'flush']:
+            return getattr(self.body, name)
+        elif self.BUILDIN_FIELDS.has_key(name):
+            if self.transfer_info is not None and name not in self.UNSNAPSHOT_FIELDS:
+                return self.transfer_info.get(name)
+
+            # a released handle isn't the client's anymore
+            return self._getinfo(name) if self.client.curl is not None else None
+
+        raise AttributeError(name)
+
+    def _getinfo(self, name):
+        value = self.BUILDIN_FIELDS[name]
+
+        if callable(value):
+            return value()
+        elif type(value) == tuple:
+            field, convert = value
+
+            return convert(self.client.curl.getinfo(field))
+        else:
+            return self.client.curl.getinfo(value)
+
+    def snapshot(self):
+        """keep the info of the finished transfer, before the handle is released"""
+        info = {}
+
+        for name in self.BUILDIN_FIELDS:
+            if name in self.UNSNAPSHOT_FIELDS:
+                continue
+
+            try:
+                info[name] = self._getinfo(name)
+            except pycurl.error:
+                pass
+
+        self.transfer_info = info
+
+    def close(self):
+        pass
+
+    def geturl(self):
+        return self.url
+
+    @property
+    def primary_ip(self):
+        if hasattr(socket, "fromfd"):
+            if self.last_socket >= 0:
+                sock = socket.fromfd(self.last_socket, socket.AF_INET, socket.SOCK_STREAM)
+
+                if sock:
+                    return sock.getpeername()[0]
+
+        try:
+            domain = urlparse(self.url).hostname
+
+            if domain:
+                if self.client.dnscache:
+                    return self.client.dnscache.get(domain)
+                else:
+                    return socket.gethostbyname(domain) if domain else None
+        except (socket.gaierror, PycurlError):
+            return None
+
+    @property
+    def headers(self):
+        from httplib import HTTPMessage
+
+        if not self.cached_headers:
+            # only the headers of the final response, after redirects and 1xx
+            starts = [i for i, line in enumerate(self.header) if line[:5] == 'HTTP/']
+
+            header = StringIO(''.join(self.header[starts[-1] if starts else 0:]))
+            try:
+                header.readline() # eat the first line 'HTTP/1.1 200 OK'
+                self.cached_headers = HTTPMessage(header)
+            finally:
+                header.close()
+
+        return self.cached_headers
+
+    info = headers
+
+    @property
+    def raw_headers(self):
+        return ''.join(self.header)
+
+class CachedResponse(HttpResponse):
+    """
+    Response served from the page cache without a transfer
+
+    The transfer info of curl doesn't apply to it, those fields are empty.
+    """
+    def __init__(self, client, request, page):
+        self.client = client
+        self.request = request
+        self.page = page
+        self._code = page.code
+
+        self.header = page.header
+        self.content = BodyBuffer.wrap(page.body)
+        self._body = None
+
+        self.cached_headers = None
+
+    def __getattr__(self, name):
+        if name == 'url':
+            return self.request.url
+        elif self.BUILDIN_FIELDS.has_key(name):
+            return None
+
+        return HttpResponse.__getattr__(self, name)
+
+class StreamResponse(HttpResponse):
+    """
+    Response which reads the body from the transfer on demand
+
+    The transfer is driven by its own multi handle whenever the consumer
+    asks for more data, the received chunks go into a bounded ring buffer
+    and curl is paused while the buffer is full, so the memory used doesn't
+    depend on the size of the body.
+    """
+    def __init__(self, client, request, buffer_size=256*1024):
+        self.client = client
+        self.request = request
+        self._code = None
+        self.header = client.header
+        self.cached_headers = None
+
+        # a single write callback never gets more than CURL_MAX_WRITE_SIZE
+        self.ring = RingBuffer(max(buffer_size, request.bufsize or 0, 16*1024))
+        self.paused = 0
+        self.finished = False
+
+        self.multi = pycurl.CurlMulti()
+
+    def _write_callback(self, buf):
+        if len(buf) > self.ring.free:
+            if len(self.ring) > 0:
+                # curl delivers the same chunk again after the unpause
+                self.paused = len(buf)
+
+                return pycurl.WRITEFUNC_PAUSE
+
+            self.ring.grow(len(buf))
+
+        self.ring.write(buf)
+
+    def start(self):
+        self.client.curl.setopt(pycurl.WRITEFUNCTION, self._write_callback)
+
+        self.multi.add_handle(self.client.curl)
+
+        # wait for the headers, which have arrived with the first byte of the body
+        while not self.finished and len(self.ring) == 0 and not self.paused:
+            self._step()
+
+        return self
+
+    def _step(self, timeout=1.0):
+        while True:
+            ret, num_handles = self.multi.perform()
+
+            if ret != pycurl.E_CALL_MULTI_PERFORM:
+                break
+
+        num_queued, ok_list, err_list = self.multi.info_read()
+
+        if ok_list or err_list:
+            self._finish(err_list[0][1] if err_list else 0)
+
+            for curl, errno, errmsg in err_list:
+                PycurlError.convert(errno, errmsg, self)
+        elif num_handles:
+            self.multi.select(timeout)
+
+    def _finish(self, errno=0):
+        if not self.finished:
+            self.finished = True
+
+            self.multi.remove_handle(self.client.curl)
+            self.snapshot()
+            self.client._cleanup(errno)
+
+    def _fill(self, size):
+        while not self.finished and len(self.ring) < size:
+            if self.paused:
+                if self.ring.free < self.paused and len(self.ring) > 0:
+                    break
+
+                self.paused = 0
+                self.client.curl.pause(pycurl.PAUSE_CONT)
+            else:
+                self._step()
+
+    def read(self, size=-1):
+        chunks = []
+
+        while size != 0:
+            self._fill(self.ring.capacity if size < 0 else min(size, self.ring.capacity))
+
+            if len(self.ring) == 0:
+                break
+
+            data = self.ring.read(size)
+
+            chunks.append(data)
+
+            if size > 0:
+                size -= len(data)
+
+        return ''.join(chunks)
+
+    def readinto(self, b):
+        self._fill(min(len(b), self.ring.capacity))
+
+        return self.ring.readinto(b)
+
+    def iter_content(self, chunk_size=16*1024):
+        while True:
+            data = self.read(chunk_size)
+
+            if not data:
+                break
+
+            yield data
+
+    __iter__ = iter_content
+
+    def close(self):
+        self._finish()
+
+        self.multi.close()
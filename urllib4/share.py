@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+import itertools
+
+import pycurl
+
+# unlike id(), a serial is never reused by another group
+_serials = itertools.count(1)
+
+class ShareGroup(object):
+    """
+    Data shared by the curl handles attached to the group
+
+    The handles share curl's DNS cache and TLS session cache, and the cookie
+    engine when cookies is set, so a short lived client resumes the TLS
+    session of another one instead of a full handshake. pycurl serializes
+    the access to the shared data with its own locks, so the handles may be
+    used on different threads.
+
+    >>> group = ShareGroup()
+    >>> HttpClient(share=group).get('https://www.google.com/')
+    >>> HttpClient(share=group).get('https://www.google.com/search?q=urllib4')
+    """
+    def __init__(self, dns=True, ssl_session=True, cookies=False):
+        self.share = pycurl.CurlShare()
+        self.cookies = cookies
+        self.serial = next(_serials)
+
+        for enabled, data in [(dns, pycurl.LOCK_DATA_DNS),
+                              (ssl_session, pycurl.LOCK_DATA_SSL_SESSION),
+                              (cookies, pycurl.LOCK_DATA_COOKIE)]:
+            if enabled:
+                self.share.setopt(pycurl.SH_SHARE, data)
+
+    def attach(self, curl):
+        # pycurl refuses to attach a handle which is still attached, even to the same share
+        curl.unsetopt(pycurl.SHARE)
+        curl.setopt(pycurl.SHARE, self.share)
+
+        if self.cookies:
+            # the shared cookies are only kept with the cookie engine enabled
+            curl.setopt(pycurl.COOKIEFILE, '')
+
+    def detach(self, curl):
+        curl.unsetopt(pycurl.SHARE)
+
+    def close(self):
+        self.share.close()
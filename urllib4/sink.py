@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+import os
+import ctypes
+import ctypes.util
+
+import pycurl
+
+FSYNC_NEVER = 0
+FSYNC_ON_CLOSE = 1
+
+FALLOC_FL_KEEP_SIZE = 1
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    _fallocate = _libc.fallocate
+    _fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong]
+except (OSError, AttributeError, TypeError):
+    _fallocate = None
+
+class FileSink(object):
+    """
+    Download target which curl writes without calling back into Python
+
+    The handle gets the OS level file through WRITEDATA, so curl fwrite()s
+    each chunk itself; flush_size sets the stdio buffer of a file opened by
+    name. The blocks can be reserved from Content-Length before the body
+    arrives, and the file fsync()ed before it's closed.
+
+    >>> HttpClient().download('http://www.google.com/', FileSink('index.html', flush_size=1024*1024))
+    """
+    def __init__(self, file_or_name, flush_size=-1, preallocate=True,
+                 fsync=FSYNC_NEVER, mode='wb', offset=0, partial=False):
+        if isinstance(file_or_name, basestring):
+            self.file = open(file_or_name, mode, flush_size)
+            self.own_file = True
+        else:
+            self.file = file_or_name
+            self.own_file = False
+
+        self.name = getattr(self.file, 'name', None)
+        self.preallocate = preallocate
+        self.fsync = fsync
+        # bytes of the entity the file already holds, the response continues after them
+        self.offset = offset
+        # only a partial response is written, the transfer of a whole body is aborted
+        self.partial = partial
+        # status of the response being written
+        self.code = None
+
+    @staticmethod
+    def accept(obj):
+        """whether curl can write the object (or the file of that name) directly"""
+        return isinstance(obj, (FileSink, file, basestring))
+
+    def attach(self, curl):
+        curl.setopt(pycurl.WRITEDATA, self.file)
+
+    def begin(self, code):
+        """
+        A response started, unless it's partial it replaces what the file already holds
+
+        @return False to abort the transfer
+        """
+        self.code = code
+
+        if self.partial and code == 200:
+            return False
+
+        if self.offset and code == 200:
+            self.file.seek(0)
+            self.file.truncate()
+            self.offset = 0
+
+    def commit(self):
+        """make the written data durable, and return how many bytes of the entity it holds"""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+        return self.file.tell()
+
+    def reserve(self, size):
+        """reserve the disk blocks for the rest of the body without changing the file size"""
+        if self.preallocate and _fallocate and size > 0:
+            self.file.flush()
+
+            _fallocate(self.file.fileno(), FALLOC_FL_KEEP_SIZE, self.file.tell(), size)
+
+    def finish(self):
+        """flush the data of a finished download, and close the file opened by name"""
+        self.file.flush()
+
+        if self.fsync == FSYNC_ON_CLOSE:
+            os.fsync(self.file.fileno())
+
+        if self.own_file:
+            self.file.close()
+
+    def close(self):
+        if not self.file.closed:
+            self.finish()
+
+        self.file.close()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+import copy
+from functools import partial
+
+try:
+    from gurl import Url
+    urlparse = Url
+except ImportError:
+    from urlparse import urlparse
+
+import pycurl
+
+from request import HttpRequest
+from flowcontrol import SiteProfile
+
+class OptionRecorder(object):
+    """Stand-in for a curl handle which records the options set on it"""
+    def __init__(self):
+        self.options = []
+
+    def setopt(self, option, value):
+        self.options.append((option, value))
+
+    def unsetopt(self, option):
+        self.options.append((option, None))
+
+class RequestTemplate(object):
+    """
+    Compiled option set shared by many near-identical requests
+
+    The options resolved from the prototype request (method, headers, auth,
+    proxy, SSL, redirects, timeouts and the site profile) are recorded once,
+    and a handle which already carries them only gets the per-request diff:
+    URL, range and the headers which differ from the prototype.
+
+    >>> template = RequestTemplate('http://www.google.com/', user_agent='urllib4')
+    >>> response = HttpClient().perform(template.request('http://www.google.com/search?q=urllib4'))
+    """
+
+    # options which are bound to the client or to a single request
+    DYNAMIC_OPTIONS = set([
+        pycurl.URL, pycurl.RANGE, pycurl.HTTPHEADER,
+        pycurl.VERBOSE, pycurl.NOPROGRESS,
+        pycurl.DEBUGFUNCTION, pycurl.HEADERFUNCTION, pycurl.WRITEFUNCTION,
+        pycurl.READFUNCTION, pycurl.PROGRESSFUNCTION, pycurl.IOCTLFUNCTION,
+    ])
+
+    if hasattr(pycurl, 'OPENSOCKETFUNCTION'):
+        DYNAMIC_OPTIONS.add(pycurl.OPENSOCKETFUNCTION)
+
+    if hasattr(pycurl, 'RESOLVE'):
+        DYNAMIC_OPTIONS.add(pycurl.RESOLVE)
+
+    def __init__(self, url, *args, **kwds):
+        self.prototype = HttpRequest(url, *args, **kwds)
+        self.domain = self.prototype.hostname()
+
+        if callable(self.prototype.data_or_reader):
+            raise ValueError("a template can't share a data reader")
+
+        o = urlparse(self.prototype.url)
+
+        self.origin = "%s://%s/" % (o.scheme, o.netloc)
+        self.headers = dict(self.prototype.headers)
+        self.header_lines = ["%s: %s" % (key, value) for key, value in self.headers.items()]
+        self.options = None
+
+    def request(self, url, headers={}, range=None):
+        """
+        Create a request from the prototype, the url must already be normalized
+        """
+        request = copy.copy(self.prototype)
+        request.url = url
+        request.headers = dict(self.headers)
+        request.headers.update(headers)
+        request.range = range
+        request.template = self
+
+        return request
+
+    def hostname(self, url):
+        if url.startswith(self.origin):
+            return self.domain
+
+        return urlparse(url).hostname
+
+    def compile(self, client):
+        """
+        Record the options which the client would set for the prototype
+        """
+        recorder = OptionRecorder()
+        curl, client.curl = client.curl, recorder
+
+        try:
+            profile = client.profile or SiteProfile.get(self.domain)
+            profile.apply(recorder)
+
+            request = copy.copy(self.prototype)
+            request.headers = {}
+
+            client._apply_request_setting(request)
+            client._apply_timeout_setting(request)
+            client._apply_network_setting(request)
+            client._apply_http_setting(request)
+            client._apply_ssl_setting(request)
+            client._apply_redirect_setting(request)
+            client._apply_auth_setting(request)
+            client._apply_proxy_setting(request)
+        finally:
+            client.curl = curl
+
+        self.options = [(option, value) for option, value in recorder.options
+                        if option not in self.DYNAMIC_OPTIONS]
+
+    def apply(self, client, request):
+        """
+        Apply the options to the handle of the client, the URL was already set
+        """
+        curl = client.curl
+
+        if client.curl_template is not self:
+            if self.options is None:
+                self.compile(client)
+
+            for option, value in self.options:
+                curl.setopt(option, value)
+
+            client.curl_template = self
+
+        curl.setopt(pycurl.HEADERFUNCTION, client._header_callback)
+        curl.setopt(pycurl.WRITEFUNCTION, client._write_callback)
+
+        if hasattr(pycurl, 'OPENSOCKETFUNCTION'):
+            curl.setopt(pycurl.OPENSOCKETFUNCTION, partial(client._create_socket, self.prototype))
+
+        if request.range:
+            curl.setopt(pycurl.RANGE, request.get_range())
+        else:
+            curl.unsetopt(pycurl.RANGE)
+
+        if len(request.headers) == len(self.headers) and request.headers == self.headers:
+            curl.setopt(pycurl.HTTPHEADER, self.header_lines)
+        else:
+            extra = [(key, value) for key, value in request.headers.items() if key not in self.headers]
+
+            if len(extra) + len(self.headers) == len(request.headers) and \
+               not [key for key in self.headers if request.headers[key] != self.headers[key]]:
+                curl.setopt(pycurl.HTTPHEADER, self.header_lines + ["%s: %s" % (key, value) for key, value in extra])
+            else:
+                curl.setopt(pycurl.HTTPHEADER, ["%s: %s" % (key, value) for key, value in request.headers.items()])
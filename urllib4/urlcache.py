@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+from __future__ import with_statement
+
+import time
+import threading
+from collections import OrderedDict
+from urlparse import urljoin, urlparse
+
+from pagecache import BasePage
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+PERMANENT_REDIRECT_CODES = (301, 308)
+
+DEFAULT_PORTS = {'http': 80, 'https': 443, 'ftp': 21}
+
+def url_origin(url):
+    """the scheme, host and port of the url"""
+    u = urlparse(url)
+
+    return u.scheme, u.hostname, u.port or DEFAULT_PORTS.get(u.scheme)
+
+def redirect_hops(url, header):
+    """
+    The redirects which the header lines of a followed response went through
+
+    @return (url, location, code) of each redirect, in order
+    """
+    hops = []
+    code = None
+
+    for line in header:
+        if line[:5] == 'HTTP/':
+            status = line.split(None, 2)
+
+            code = int(status[1]) if len(status) > 1 and status[1].isdigit() else None
+        elif code in REDIRECT_CODES and line[:9].lower() == 'location:':
+            location = urljoin(url, line[9:].strip())
+
+            hops.append((url, location, code))
+
+            url = location
+
+    return hops
+
+class UrlCache(object):
+    """
+    Bounded cache of what's known about URLs or hosts, each entry for ttl seconds
+
+    The least recently used entry is evicted beyond max_entries.
+    """
+    def __init__(self, max_entries=10000, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _get(self, key, now=None):
+        """the entry of the key, the lock must be held"""
+        entry = self.entries.pop(key, None)
+
+        if entry is None:
+            return None
+
+        value, expires = entry
+
+        if expires is not None and (now or time.time()) >= expires:
+            return None
+
+        self.entries[key] = entry
+
+        return value
+
+    def _set(self, key, value, now=None):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (value, (now or time.time()) + self.ttl if self.ttl else None)
+
+            while self.max_entries and len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+class RedirectCache(UrlCache):
+    """
+    Permanent redirects (301 and 308) of the URLs, so a request goes straight to the final URL
+
+    The client only skips the redirects which stay on the scheme, host and port of the request.
+
+    >>> redirects = RedirectCache()
+    >>> HttpClient(redirectcache=redirects).get('http://www.google.com/mail')
+    >>> HttpClient(redirectcache=redirects).get('http://www.google.com/mail') # http://www.google.com/mail/
+    """
+    def __init__(self, max_entries=10000, ttl=86400, max_hops=10):
+        UrlCache.__init__(self, max_entries, ttl)
+
+        self.max_hops = max_hops
+
+    def add(self, url, location):
+        self._set(url, location)
+
+    def learn(self, url, header):
+        """remember the permanent redirects which the response of the url went through"""
+        for url, location, code in redirect_hops(url, header):
+            if code in PERMANENT_REDIRECT_CODES:
+                self.add(url, location)
+
+    def resolve(self, url, now=None, same_origin=False):
+        """
+        @return the final URL of the permanent redirects from the url, or the url itself
+
+        With same_origin, the redirects stop at the first one which leaves the origin of the url.
+        """
+        seen = set([url])
+        origin = url_origin(url) if same_origin else None
+
+        with self.lock:
+            for i in range(self.max_hops):
+                location = self._get(url, now)
+
+                if location is None or location in seen or \
+                   (origin is not None and url_origin(location) != origin):
+                    break
+
+                seen.add(location)
+                url = location
+
+            if len(seen) > 1:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        return url
+
+class NegativeCache(UrlCache):
+    """
+    Definitive failures, the 404 and 410 responses of the URLs and the hosts which didn't resolve
+
+    A response is remembered for the method of its request, a HEAD one has no body.
+
+    A request to a remembered URL gets the failed response again, and one to a
+    remembered host raises the error again, without a transfer.
+    """
+    CODES = (404, 410)
+
+    def __init__(self, max_entries=10000, ttl=60, codes=CODES):
+        UrlCache.__init__(self, max_entries, ttl)
+
+        self.codes = codes
+
+    def add_response(self, url, code, header, body, method='GET'):
+        if code in self.codes:
+            self._set(('url', method, url), BasePage(self, url, code=code, header=header, body=body))
+
+    def add_error(self, host, code, msg):
+        self._set(('host', host), (code, msg))
+
+    def get_response(self, url, method='GET', now=None):
+        """@return the page of the failed response of the url to the method, or None"""
+        return self._lookup(('url', method, url), now)
+
+    def get_error(self, host, now=None):
+        """@return the error code and message of resolving the host, or None"""
+        return self._lookup(('host', host), now)
+
+    def _lookup(self, key, now=None):
+        with self.lock:
+            value = self._get(key, now)
+
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+            return value